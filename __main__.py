@@ -0,0 +1,3 @@
+from pyEDIutils.jobs import main
+
+main()
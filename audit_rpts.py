@@ -1,4 +1,6 @@
 import pyEDIutils.pasta_api_requests as rq
+import pyEDIutils.xmlparse as xp
+import pyEDIutils.useragents as ua
 import pandas as pd
 from datetime import date
 import os
@@ -10,15 +12,15 @@ def auditroot_to_df(ediroot):
     date, packageid, and service method extracted into a row in the 
     dataframe.
     """
-    # Iterate over each element in ediroot and extract the variables
+    # Extract the variables from ediroot in a single pass
     print(ediroot.text)
-    df = pd.DataFrame({'scope':[scope.text for scope in ediroot.iter('scope')],
-        'identifier':[int(ident.text) for ident in ediroot.iter('identifier')],
-        'revision':[int(rev.text) for rev in ediroot.iter('revision')],
-        'resource':[rtype.text for rtype in ediroot.iter('resourceType')],
-        'total_reads':[int(tot.text) for tot in ediroot.iter('totalReads')],
-        'non_robot_reads':[int(nrr.text) for nrr 
-                           in ediroot.iter('nonRobotReads')]}
+    cols = xp.extract(ediroot, xp.SCHEMAS['audit'])
+    df = pd.DataFrame({'scope':cols['scope'],
+        'identifier':[int(ident) for ident in cols['identifier']],
+        'revision':[int(rev) for rev in cols['revision']],
+        'resource':cols['resourceType'],
+        'total_reads':[int(tot) for tot in cols['totalReads']],
+        'non_robot_reads':[int(nrr) for nrr in cols['nonRobotReads']]}
         )
     return(df)
 
@@ -28,15 +30,16 @@ def auditreport_to_df(ediroot):
     date, packageid, and service method extracted into a row in the 
     dataframe.
     """
-    # Iterate over each element in ediroot and extract the variables
+    # Extract the variables from ediroot in a single pass
     print(ediroot.text)
+    cols = xp.extract(ediroot, xp.SCHEMAS['auditreport'])
     df = pd.DataFrame({
-        'entry_dt':[etime.text for etime in ediroot.iter('entryTime')],
-        'method':[meth.text for meth in ediroot.iter('serviceMethod')],
-        'resource_id':[rid.text for rid in ediroot.iter('resourceId')],
-        'user':[user.text for user in ediroot.iter('user')],
-        'group':[groups.text for groups in ediroot.iter('groups')],
-        'useragent':[agent.text for agent in ediroot.iter('userAgent')]}
+        'entry_dt':cols['entryTime'],
+        'method':cols['serviceMethod'],
+        'resource_id':cols['resourceId'],
+        'user':cols['user'],
+        'group':cols['groups'],
+        'useragent':cols['userAgent']}
         )
     return(df)
 
@@ -76,7 +79,7 @@ def request_audit(identifier, rev=None, scope='knb-lter-jrn'):
 
 def request_audit_report(servmethod, dn, pw, user=None, group=None,
                        resid='knb-lter-jrn', fromdt=date.today(), todt=None,
-                       lim=10000):
+                       lim=10000, classify_agents=False, **kwargs):
     """Get an audit report from PASTA+
 
     Parameters
@@ -103,13 +106,20 @@ def request_audit_report(servmethod, dn, pw, user=None, group=None,
         by default None
     lim : int, optional
         Maximum number of audit records to return, by default 10000
+    classify_agents : bool, optional
+        Add agent_category and is_robot columns (see useragents), by
+        default False
+    **kwargs
+        base_url and login_url, passed on to aud_report_dpm
     """
     # An element tree will be returned from the api request
     print('Requesting audit report for {0} starting {1}'.format(resid, fromdt))
     response = rq.aud_report_dpm(servmethod, user, group, resid, fromdt, todt, lim,
-                   dn, pw)
+                   dn, pw, **kwargs)
     root = rq.response_to_ET(response)
     # Convert elements to rows in dataframe
     df_out = auditreport_to_df(root)
+    if classify_agents:
+        df_out = ua.add_agent_class(df_out)
 
     return(df_out)
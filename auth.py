@@ -0,0 +1,129 @@
+"""Reusable PASTA authentication sessions.
+
+PASTA answers a request made with HTTP basic auth by setting an
+'auth-token' cookie; sending that cookie on later requests authenticates
+them without another LDAP bind. An AuthSession logs in once, reuses the
+token for every call (from any thread) and logs in again shortly before the
+token expires, or if PASTA rejects it.
+"""
+import pyEDIutils.throttle as th
+import requests
+import base64
+import hashlib
+import threading
+import time
+
+LOGIN_URL = 'https://pasta.lternet.edu/package/eml'
+# Token lifetime to assume if the expiry cannot be read from the token
+DEFAULT_TTL = 600
+
+
+def token_expiry(token):
+    """Read the expiry time (epoch seconds) from a PASTA auth-token
+
+    The token is base64(userid*authsystem*expiry_ms*groups...) followed by
+    '-' and a base64 signature. Returns None if it cannot be parsed.
+    """
+    try:
+        decoded = base64.b64decode(token.split('-')[0]).decode('utf-8')
+        return(int(decoded.split('*')[2]) / 1000.0)
+    except (ValueError, IndexError, UnicodeDecodeError):
+        return(None)
+
+
+class AuthSession(object):
+    """Authenticated PASTA session that logs in once and reuses the token.
+
+    Parameters
+    ----------
+    dn : str
+        Distinguished name for HTTP basic authentication
+    pw : str
+        Password for HTTP basic authentication
+    login_url : str, optional
+        URL requested with basic auth to obtain a token, by default LOGIN_URL
+    refresh_margin : float, optional
+        seconds before expiry at which the token is renewed, by default 60
+    """
+
+    def __init__(self, dn, pw, login_url=LOGIN_URL, refresh_margin=60):
+        self.dn = dn
+        self._pw = pw
+        self.login_url = login_url
+        self.refresh_margin = refresh_margin
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+        self.token = None
+        self.expires = 0.0
+        self.logins = 0
+
+    def login(self):
+        """Authenticate with basic auth and store the auth-token cookie"""
+        response = th.get(self.login_url, session=self.session,
+                          auth=(self.dn, self._pw))
+        print(response.request.url)
+        response.raise_for_status()
+        token = response.cookies.get('auth-token')
+        if token is None:
+            raise requests.HTTPError(
+                'No auth-token returned by {0}'.format(self.login_url),
+                response=response)
+        # Send the token explicitly rather than through the cookie jar
+        self.session.cookies.clear()
+        self.token = token
+        self.expires = token_expiry(token) or time.time() + DEFAULT_TTL
+        self.logins += 1
+
+    def _current_token(self, stale=None):
+        with self.lock:
+            if (self.token is None or self.token == stale or
+                    time.time() > self.expires - self.refresh_margin):
+                self.login()
+            return(self.token)
+
+    def get(self, url, **kwargs):
+        """GET `url` with the auth-token, logging in again if it is rejected
+
+        Parameters
+        ----------
+        url : str
+            Request URL
+        **kwargs
+            Passed on to `throttle.get`
+        """
+        token = self._current_token()
+        response = th.get(url, session=self.session,
+                          cookies={'auth-token': token}, **kwargs)
+        if response.status_code == 401:
+            # Token revoked or expired early; renew once (unless another
+            # thread already has) and retry
+            response.close()
+            token = self._current_token(stale=token)
+            response = th.get(url, session=self.session,
+                              cookies={'auth-token': token}, **kwargs)
+        return(response)
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(dn, pw, **kwargs):
+    """Return the shared AuthSession for a set of credentials
+
+    Parameters
+    ----------
+    dn : str
+        Distinguished name for HTTP basic authentication
+    pw : str
+        Password for HTTP basic authentication
+    **kwargs
+        Passed on to AuthSession when a new session is created
+    """
+    # Sessions are per server as well as per credentials
+    key = (dn, hashlib.sha256(pw.encode('utf-8')).hexdigest(),
+           kwargs.get('login_url', LOGIN_URL))
+    with _sessions_lock:
+        if key not in _sessions:
+            _sessions[key] = AuthSession(dn, pw, **kwargs)
+        return(_sessions[key])
@@ -0,0 +1,74 @@
+"""Parse-only benchmark of the lxml and stdlib XML backends.
+
+Times parsing plus single-pass extraction of the changes schema for each
+available backend and checks that both return identical values. Pass
+archived change responses ('.xml' or '.xml.gz') on the command line, or
+run without arguments to use a synthetic response of --records records:
+
+    python -m pyEDIutils.benchmarks.parse_backends [--records N] [files ...]
+"""
+import pyEDIutils.pasta_api_requests as rq
+import pyEDIutils.xmlparse as xp
+import argparse
+import os
+import tempfile
+import time
+
+
+def synthetic_changes(path, n):
+    """Write a PASTA-like changes response with n dataPackage records"""
+    with open(path, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<dataPackageChanges>\n')
+        for i in range(n):
+            f.write('<dataPackage><packageId>knb-lter-jrn.{0}.1</packageId>'
+                '<scope>knb-lter-jrn</scope><identifier>{0}</identifier>'
+                '<revision>1</revision><principal>uid=JRN</principal>'
+                '<doi>doi:10.6073/pasta/{1:032x}</doi>'
+                '<serviceMethod>{2}</serviceMethod>'
+                '<date>2020-01-{3:02d}T12:00:00.000</date></dataPackage>\n'
+                .format(210000000 + i, i, ('createDataPackage',
+                    'updateDataPackage')[i % 2], i % 28 + 1))
+        f.write('</dataPackageChanges>\n')
+
+
+def run(files, repeat=3):
+    backends = ['stdlib'] + (['lxml'] if xp._lxml is not None else [])
+    results = {}
+    for b in backends:
+        xp.set_backend(b)
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            out = [xp.extract(rq.archived_response_to_ET(f),
+                              xp.SCHEMAS['changes']) for f in files]
+            best = min(best, time.perf_counter() - start)
+        results[b] = (best, out)
+        print('{0:>7}: {1:.3f}s'.format(b, best))
+    if len(results) == 2:
+        assert results['lxml'][1] == results['stdlib'][1], \
+            'Backends returned different values'
+        print('Identical output, lxml speedup {0:.1f}x'.format(
+            results['stdlib'][0] / results['lxml'][0]))
+    else:
+        print('lxml is not installed, only the stdlib backend was timed')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('--records', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+    if args.files:
+        run(args.files, args.repeat)
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'changes.xml')
+        synthetic_changes(path, args.records)
+        print('Synthetic response: {0} records, {1:.1f} MB'.format(
+            args.records, os.path.getsize(path) / 1e6))
+        run([path], args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,11 @@
 import pyEDIutils.pasta_api_requests as rq
+import pyEDIutils.xmlparse as xp
+import pyEDIutils.checksums as cs
 import pandas as pd
+from datetime import datetime
+import gzip
 import os
+import zlib
 
     
 def changeroot_to_df(ediroot):
@@ -14,10 +19,11 @@ def changeroot_to_df(ediroot):
     ediroot : xml tree
         An XML tree returned from an EDI changes request
     """
-    # Iterate over each element in ediroot and extract the variables
-    df = pd.DataFrame({'date':[date.text for date in ediroot.iter('date')],
-                   'pkgid':[int(ID.text) for ID in ediroot.iter('identifier')],
-                   'action':[sm.text for sm in ediroot.iter('serviceMethod')]}
+    # Extract the variables from ediroot in a single pass
+    cols = xp.extract(ediroot, xp.SCHEMAS['changes'])
+    df = pd.DataFrame({'date':cols['date'],
+                   'pkgid':[int(ID) for ID in cols['identifier']],
+                   'action':cols['serviceMethod']}
                      )
     return(df)
 
@@ -37,10 +43,61 @@ def drop_duplicates(df):
     print('{0} duplicate records were removed.'.format(n_dupdeletes))
     return(df_dd)
     
+class _GzipCheck(object):
+    """Decompress (and discard) a gzip stream to check it is complete."""
+
+    def __init__(self):
+        self.d = zlib.decompressobj(wbits=31)
+
+    def update(self, data):
+        self.d.decompress(data)
+        # Concatenated gzip members each need a new decompressor
+        while self.d.eof and self.d.unused_data:
+            rest = self.d.unused_data
+            self.d = zlib.decompressobj(wbits=31)
+            self.d.decompress(rest)
+
+    def complete(self):
+        return self.d.eof
+
+
+def verify_archive(path):
+    """Check an archived response against its '.sha256' sidecar file
+
+    Parameters
+    ----------
+    path : str
+        path to an archive written by archive_requested_changes
+
+    Returns
+    -------
+    bool
+        True if the checksum matches, False if there is no sidecar (for
+        archives written before checksums were recorded)
+
+    Raises
+    ------
+    checksums.ChecksumError
+        if the archive does not match its recorded checksum
+    """
+    sidecar = path + '.sha256'
+    if not os.path.exists(sidecar):
+        return(False)
+    with open(sidecar, 'r') as f:
+        expected = f.read().split()[0]
+    digest = cs.file_digest(path, 'sha256').hexdigest()
+    if digest != expected:
+        raise cs.ChecksumError('{0}: SHA-256 {1} does not match recorded '
+                               '{2}'.format(path, digest, expected))
+    return(True)
+
+
 def load_archived_changes(input_path, scope='knb-lter-jrn',
-    dedup=True, parsedt=False):
+    dedup=True, parsedt=False, verify=True):
     """
     Load archived PASTA change records from xml files and parse into dataframe.
+    Both plain ('.xml') and gzip compressed ('.xml.gz') archives are read.
+    Archives with a '.sha256' sidecar are checked against it first.
 
     Parameters
     ----------
@@ -52,14 +109,19 @@ def load_archived_changes(input_path, scope='knb-lter-jrn',
         remove duplicates boolean, by default True
     parsedt : bool, optional
         parse 'date' field to datetime index boolean, by default False
+    verify : bool, optional
+        check archives against their recorded SHA-256, by default True
     """
     # List files and select scope
     files = os.listdir(input_path)
-    scopefiles = sorted([f for f in files if scope in f])
+    scopefiles = sorted([f for f in files if scope in f and
+        (f.endswith('.xml') or f.endswith('.xml.gz'))])
     # Load each archive, convert to dataframe, and concatenate
     for i, f in enumerate(scopefiles):
         print('Reading archived PASTA request {0}'.format(f))
-        root = rq.archived_response_to_ET(os.path.join('edi_requests', f))
+        if verify:
+            verify_archive(os.path.join(input_path, f))
+        root = rq.archived_response_to_ET(os.path.join(input_path, f))
         df = changeroot_to_df(root)
         if i==0:
             df_out = df
@@ -74,10 +136,19 @@ def load_archived_changes(input_path, scope='knb-lter-jrn',
     return(df_out)
 
 def archive_requested_changes(output_path, fromdt, todt=None,
-    scope='knb-lter-jrn'):
+    scope='knb-lter-jrn', compress=True, chunk_size=1024*1024):
     """
-    Request PASTA change records in specified temporal range and parse
-    into a dataframe.
+    Request PASTA change records in specified temporal range and archive
+    the xml response to disk.
+
+    The response is streamed to disk in chunks, so the full body is never
+    held in memory. By default the archive is written gzip compressed
+    ('.xml.gz'); when PASTA already sends the body gzip-encoded it is
+    written as received instead of being decoded and compressed again.
+    load_archived_changes reads either form. The SHA-256 of the archive
+    file is computed while writing and recorded next to it in
+    '<archive>.sha256' (sha256sum format), which load_archived_changes
+    checks before parsing.
 
     Parameters
     ----------
@@ -86,22 +157,67 @@ def archive_requested_changes(output_path, fromdt, todt=None,
     fromdt : string
         datetime string (YYYY-MM-DD)
     todt : string, optional
-        datetime string (YYYY-MM-DD), by default None
+        datetime string (YYYY-MM-DD), by default None (today)
     scope : str, optional
         EDI scope string, by default 'knb-lter-jrn'
-    
+    compress : bool, optional
+        write a gzip compressed archive, by default True
+    chunk_size : int, optional
+        bytes per streamed chunk, by default 1 MiB
+
+    Returns
+    -------
+    tuple
+        (archive file path, SHA-256 hex digest of the archive file)
     """
+    if todt is None:
+        todt = datetime.today().strftime('%Y-%m-%d')
     # An element tree will be returned from the api request
     print('Requesting PASTA changes for {0} from {1} to {2}'.format(
         scope, fromdt, todt))
-    response = rq.recent_changes(scope, fromdt, todt)
+    response = rq.recent_changes(scope, fromdt, todt, stream=True)
+    response.raise_for_status()
     # Get outfile
     output_file_path = os.path.join(output_path, 
-        scope + '_' + fromdt.replace('-', '') + '-' + todt.replace('-', '') + '.xml')
+        scope + '_' + fromdt.replace('-', '') + '-' + todt.replace('-', '') +
+        ('.xml.gz' if compress else '.xml'))
     print("Archiving request at {0}".format(output_file_path))
-    # Convert elements to rows in dataframe
-    with open(output_file_path, 'w') as f:
-        f.write(response.text)
+    # Stream chunks to a temporary file, hashing what is written, then
+    # move it into place so a failed transfer never leaves a partial archive
+    passthrough = (compress and
+        response.headers.get('Content-Encoding', '').strip() == 'gzip')
+    tmp_path = output_file_path + '.part'
+    try:
+        with response, open(tmp_path, 'wb') as raw:
+            f = cs.HashingWriter(raw, 'sha256')
+            if passthrough:
+                # Keep PASTA's gzip stream, checking that it is complete
+                check = _GzipCheck()
+                for chunk in response.raw.stream(chunk_size,
+                                                 decode_content=False):
+                    check.update(chunk)
+                    f.write(chunk)
+                if not check.complete():
+                    raise IOError('Truncated gzip response for {0}'.format(
+                        output_file_path))
+            elif compress:
+                with gzip.GzipFile(fileobj=f, mode='wb') as gz:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        gz.write(chunk)
+            else:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+        checksum = f.hash.hexdigest()
+        os.replace(tmp_path, output_file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    with open(output_file_path + '.sha256.part', 'w') as sf:
+        sf.write('{0}  {1}\n'.format(checksum,
+                                     os.path.basename(output_file_path)))
+    os.replace(output_file_path + '.sha256.part', output_file_path + '.sha256')
+    print("SHA-256 {0}".format(checksum))
+    return(output_file_path, checksum)
 
 
 def request_changes(fromdt, todt=None, scope='knb-lter-jrn',
@@ -0,0 +1,80 @@
+"""Checksum helpers shared by the download and archive code.
+
+Data is hashed as it passes through a file-like wrapper, so verifying a
+transfer never needs a second read of the data. `file_digest` covers the
+cases where a file on disk has to be hashed after the fact (resuming a
+partial download, checking an archive).
+"""
+import hashlib
+
+
+class ChecksumError(IOError):
+    """Data does not match the checksum it was expected to have."""
+
+
+class HashingReader(object):
+    """File-like wrapper that hashes everything read through it.
+
+    Parameters
+    ----------
+    raw : file-like
+        object to read from
+    algorithm : str, optional
+        hashlib algorithm name, by default 'sha1' (PASTA's entity checksum)
+    limiter : object, optional
+        anything with a `consume(nbytes)` method (e.g.
+        download.BandwidthLimiter), called after each read, by default None
+    """
+
+    def __init__(self, raw, algorithm='sha1', limiter=None):
+        self.raw = raw
+        self.hash = hashlib.new(algorithm)
+        self.limiter = limiter
+        self.nbytes = 0
+
+    def read(self, n=-1):
+        data = self.raw.read(n)
+        self.hash.update(data)
+        self.nbytes += len(data)
+        if self.limiter is not None and data:
+            self.limiter.consume(len(data))
+        return data
+
+    def readable(self):
+        return True
+
+
+class HashingWriter(object):
+    """File-like wrapper that hashes everything written through it.
+
+    Parameters
+    ----------
+    raw : file-like
+        object to write to
+    algorithm : str, optional
+        hashlib algorithm name, by default 'sha256'
+    """
+
+    def __init__(self, raw, algorithm='sha256'):
+        self.raw = raw
+        self.hash = hashlib.new(algorithm)
+
+    def write(self, data):
+        self.hash.update(data)
+        return self.raw.write(data)
+
+    def flush(self):
+        self.raw.flush()
+
+
+def file_digest(path, algorithm='sha1', chunk_size=1024*1024):
+    """Hash a file on disk in chunks
+
+    Returns the hashlib object rather than the digest so that callers can
+    keep updating it (e.g. when resuming a download).
+    """
+    h = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return(h)
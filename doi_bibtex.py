@@ -1,6 +1,6 @@
 ## Written by Claude, prompted and lightly edited by Greg
-import requests
 import pyEDIutils.pasta_api_requests as rq
+import pyEDIutils.throttle as th
 from urllib.parse import urlparse, parse_qs
 import time
 
@@ -49,7 +49,7 @@ def pkg_doi(scope, identifier):
     rq_url = "https://pasta.lternet.edu/package/doi/eml/" + "/".join(
         [scope, str(identifier), revision]
     )
-    response = requests.get(rq_url)
+    response = th.get(rq_url)
     print(response.request.url)
 
     if response.status_code == 200:
@@ -77,7 +77,7 @@ def doi_to_bibtex(doi):
     """
     # Strip the "doi:" prefix if present, then build the doi.org URL
     doi_clean = doi.replace("doi:", "").strip()
-    response = requests.get(
+    response = th.get(
         f"https://doi.org/{doi_clean}",
         headers={"Accept": "application/x-bibtex"},
         allow_redirects=True,
@@ -0,0 +1,239 @@
+import pyEDIutils.pasta_api_requests as rq
+import pyEDIutils.checksums as cs
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import threading
+import time
+
+
+# Raised when a download does not match PASTA's checksum
+ChecksumError = cs.ChecksumError
+
+
+class BandwidthLimiter(object):
+    """Cap the combined transfer rate of one or more download threads.
+
+    Each thread calls `consume` with the number of bytes it just received
+    and is made to sleep long enough that the total rate across threads
+    stays at or below `max_bps` bytes per second.
+    """
+
+    def __init__(self, max_bps):
+        self.max_bps = float(max_bps)
+        self.lock = threading.Lock()
+        self.next_free = time.monotonic()
+
+    def consume(self, nbytes):
+        with self.lock:
+            now = time.monotonic()
+            self.next_free = max(self.next_free, now) + nbytes / self.max_bps
+            wait = self.next_free - now
+        if wait > 0:
+            time.sleep(wait)
+
+
+def _part_complete(response, offset, sha1, checksum):
+    """Whether a 416 (range not satisfiable) means the '.part' file is done
+
+    With a checksum, the '.part' data must match it. Without one, the
+    entity size from the 'Content-Range: bytes */<size>' header must equal
+    the '.part' size.
+    """
+    if checksum is not None:
+        return(sha1.hexdigest() == checksum)
+    total = response.headers.get('Content-Range', '').rpartition('/')[2]
+    return(total.isdigit() and int(total) == offset)
+
+
+def download_entity(scope, identifier, revision, entityid, outfile,
+                    chunk_size=1024*1024, resume=True, verify=True,
+                    limiter=None, checksum=None):
+    """Stream a PASTA data entity to a file on disk
+
+    Data is written in chunks to '<outfile>.part' and moved to `outfile` once
+    complete. If a '.part' file is left from an interrupted transfer, only the
+    remainder is requested (HTTP Range); a '.part' file that turns out to be
+    complete (416 response) is checked and kept. The SHA-1 of the data is computed
+    while streaming and compared with PASTA's entity checksum.
+
+    Parameters
+    ----------
+    scope : string
+        EDI scope for the request
+    identifier : int
+        Data package identifier
+    revision : int
+        Revision number of the data package
+    entityid : string
+        identifier hash for the entity in PASTA
+    outfile : str
+        path of the file to write
+    chunk_size : int, optional
+        bytes per streamed chunk, by default 1 MiB
+    resume : bool, optional
+        continue from an existing '.part' file, by default True
+    verify : bool, optional
+        check the data against PASTA's checksum, by default True
+    limiter : BandwidthLimiter, optional
+        shared limiter to cap the transfer rate, by default None
+    checksum : str, optional
+        expected SHA-1, if already known, to save a checksum request when
+        verify is True, by default None
+
+    Returns
+    -------
+    dict
+        path, bytes transferred, resumed_from offset, and sha1 digest
+    """
+    if verify and checksum is None:
+        checksum = rq.pkg_entity_checksum(scope, identifier, revision,
+                                          entityid)
+    elif not verify:
+        checksum = None
+    part = outfile + '.part'
+    offset = os.path.getsize(part) if (resume and os.path.exists(part)) else 0
+    sha1 = cs.file_digest(part) if offset else hashlib.sha1()
+    response = rq.pkg_entity_data(scope, identifier, revision, entityid,
+                                  offset=offset)
+    if offset and response.status_code == 416 and _part_complete(
+            response, offset, sha1, checksum):
+        # The '.part' file already holds the whole entity
+        response.close()
+        digest = sha1.hexdigest()
+        os.replace(part, outfile)
+        return({'path': outfile, 'bytes': 0, 'resumed_from': offset,
+                'sha1': digest})
+    if offset and response.status_code != 206:
+        # Server ignored or refused the range, so start over
+        print('Cannot resume {0}, restarting download'.format(outfile))
+        response.close()
+        offset = 0
+        sha1 = hashlib.sha1()
+        response = rq.pkg_entity_data(scope, identifier, revision, entityid)
+    response.raise_for_status()
+    nbytes = 0
+    with response, open(part, 'ab' if offset else 'wb') as f:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            f.write(chunk)
+            sha1.update(chunk)
+            nbytes += len(chunk)
+            if limiter is not None:
+                limiter.consume(len(chunk))
+    digest = sha1.hexdigest()
+    if checksum is not None and digest != checksum:
+        os.remove(part)
+        raise ChecksumError('{0}: SHA-1 {1} does not match PASTA {2}'.format(
+            outfile, digest, checksum))
+    os.replace(part, outfile)
+    return({'path': outfile, 'bytes': nbytes, 'resumed_from': offset,
+            'sha1': digest})
+
+
+def read_entity_chunks(scope, identifier, revision, entityid,
+                       chunksize=100000, verify=True, limiter=None, **kwargs):
+    """Stream a tabular PASTA data entity into pandas in chunks
+
+    The response body is fed directly to `pandas.read_csv` without being
+    stored, and hashed as it is read. After the last chunk the SHA-1 is
+    compared with PASTA's entity checksum.
+
+    Parameters
+    ----------
+    scope : string
+        EDI scope for the request
+    identifier : int
+        Data package identifier
+    revision : int
+        Revision number of the data package
+    entityid : string
+        identifier hash for the entity in PASTA
+    chunksize : int, optional
+        rows per dataframe chunk, by default 100000
+    verify : bool, optional
+        check the data against PASTA's checksum, by default True
+    limiter : BandwidthLimiter, optional
+        shared limiter to cap the transfer rate, by default None
+    **kwargs
+        passed on to `pandas.read_csv`
+
+    Yields
+    ------
+    dataframe
+        successive chunks of the entity table
+    """
+    checksum = rq.pkg_entity_checksum(scope, identifier, revision,
+        entityid) if verify else None
+    response = rq.pkg_entity_data(scope, identifier, revision, entityid)
+    response.raise_for_status()
+    response.raw.decode_content = True
+    reader = cs.HashingReader(response.raw, limiter=limiter)
+    with response:
+        for chunk in pd.read_csv(reader, chunksize=chunksize, **kwargs):
+            yield chunk
+        # Hash any trailing bytes the parser did not need
+        while reader.read(1024*1024):
+            pass
+    digest = reader.hash.hexdigest()
+    if checksum is not None and digest != checksum:
+        raise ChecksumError('{0}.{1}.{2}/{3}: SHA-1 {4} does not match '
+            'PASTA {5}'.format(scope, identifier, revision, entityid, digest,
+                               checksum))
+
+
+def download_entities(entities, outdir, max_workers=4, max_bps=None,
+                      **kwargs):
+    """Download several PASTA data entities in parallel
+
+    Files are written to '<outdir>/<scope>.<identifier>.<revision>/', named
+    by the base name of the 'filename' column if present and the entity id
+    otherwise.
+
+    Parameters
+    ----------
+    entities : dataframe
+        one row per entity with 'scope', 'identifier', 'revision' and
+        'entityid' columns (and optionally 'filename')
+    outdir : str
+        directory to download into
+    max_workers : int, optional
+        maximum number of simultaneous downloads, by default 4
+    max_bps : float, optional
+        cap on combined bytes per second across downloads, by default None
+    **kwargs
+        passed on to download_entity
+
+    Returns
+    -------
+    dataframe
+        the entities table with 'path', 'bytes', 'resumed_from', 'sha1'
+        and 'error' columns added
+    """
+    limiter = BandwidthLimiter(max_bps) if max_bps else None
+
+    def fetch(row):
+        pkgdir = os.path.join(outdir, '.'.join([row.scope,
+            str(row.identifier), str(row.revision)]))
+        os.makedirs(pkgdir, exist_ok=True)
+        # Only the base name of the metadata file name is used, so it cannot
+        # point outside pkgdir
+        fname = getattr(row, 'filename', '')
+        fname = os.path.basename(fname) if isinstance(fname, str) else ''
+        if fname in ('', '.', '..'):
+            fname = row.entityid
+        try:
+            out = download_entity(row.scope, row.identifier, row.revision,
+                row.entityid, os.path.join(pkgdir, fname), limiter=limiter,
+                **kwargs)
+            out['error'] = None
+        except Exception as e:
+            print('Download of {0} failed: {1!r}'.format(fname, e))
+            out = {'error': repr(e)}
+        return(out)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(fetch, entities.itertuples(index=False)))
+    df_out = pd.concat([entities.reset_index(drop=True),
+                        pd.DataFrame(results)], axis=1)
+    return(df_out)
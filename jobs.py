@@ -0,0 +1,333 @@
+"""Run a declarative job manifest of pyEDIutils calls as a dependency graph.
+
+A manifest is a JSON file naming the steps of a report. Each step calls a
+pyEDIutils function ('module.function'), may take the output of other steps
+as arguments, and may write its result to a file:
+
+    {
+      "workdir": "ar2025",
+      "steps": {
+        "changes": {"call": "changes.request_changes",
+                    "args": {"fromdt": "2025-01-01", "todt": "2025-12-31"}},
+        "counts": {"call": "changes.get_counts", "args": {"df": "@changes"}},
+        "daily": {"call": "changes.counts_to_daily",
+                  "args": {"df": "@counts"}, "output": "daily.csv"},
+        "search": {"call": "search.search_pasta",
+                   "args": {"query": "scope:knb-lter-jrn", "rows": 1000},
+                   "output": "packages.csv"},
+        "audit": {"call": "audit_rpts.request_audit_report",
+                  "args": {"servmethod": "readDataPackage",
+                           "dn": {"env": "EDI_DN"}, "pw": {"env": "EDI_PW"},
+                           "fromdt": "2025-01-01"}}
+      }
+    }
+
+An argument value "@name" is replaced by the output of step `name` (and
+makes this step depend on it); {"env": "NAME"} is replaced by an environment
+variable, so credentials stay out of the manifest. Extra dependencies can be
+listed in "depends". Steps whose dependencies are done run in parallel, all
+steps share one HTTP session and response cache (see `throttle`), and each
+finished step is checkpointed in '<workdir>/.checkpoints' so that a rerun
+skips it unless its definition, or one upstream, changed (a step's output
+file is rewritten from its checkpoint if it is missing).
+
+Run from the command line with:
+
+    python -m pyEDIutils run manifest.json [--workers 4] [--force]
+"""
+import pyEDIutils.throttle as th
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import pickle
+import time
+
+
+def load_manifest(path):
+    """Load a JSON job manifest and fill in dependencies from '@' references
+
+    Parameters
+    ----------
+    path : str
+        path to the manifest file
+
+    Returns
+    -------
+    dict
+        The manifest, with a complete 'depends' list for every step
+    """
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    # A relative workdir is taken relative to the manifest file
+    return(normalize_manifest(manifest,
+                              os.path.dirname(os.path.abspath(path))))
+
+
+def normalize_manifest(manifest, base_dir=None):
+    """Check a manifest dict and fill in dependencies and the workdir
+
+    Parameters
+    ----------
+    manifest : dict
+        manifest with 'steps' and optionally 'workdir'
+    base_dir : str, optional
+        directory a relative workdir is taken relative to, by default the
+        current directory
+
+    Returns
+    -------
+    dict
+        a copy of the manifest with a complete 'depends' list for every
+        step and an absolute 'workdir'
+    """
+    manifest = dict(manifest)
+    steps = {name: dict(step)
+             for name, step in manifest.get('steps', {}).items()}
+    for name, step in steps.items():
+        if 'call' not in step:
+            raise ValueError('Step {0} has no "call"'.format(name))
+        deps = set(step.get('depends', []))
+        deps.update(_references(step.get('args', {})))
+        for d in deps:
+            if d not in steps:
+                raise ValueError('Step {0} depends on unknown step {1}'.format(
+                    name, d))
+        step['depends'] = sorted(deps)
+    _check_acyclic(steps)
+    manifest['steps'] = steps
+    manifest['workdir'] = os.path.join(base_dir or os.getcwd(),
+                                       manifest.get('workdir', '.'))
+    return(manifest)
+
+
+def _references(value):
+    """Step names referenced as '@name' anywhere in an argument value"""
+    if isinstance(value, str) and value.startswith('@'):
+        return {value[1:]}
+    if isinstance(value, dict):
+        return set().union(*[_references(v) for v in value.values()])
+    if isinstance(value, list):
+        return set().union(*[_references(v) for v in value])
+    return set()
+
+
+def _check_acyclic(steps):
+    state = {}
+    def visit(name, path):
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError('Dependency cycle: ' + ' -> '.join(path + [name]))
+        state[name] = 'visiting'
+        for d in steps[name]['depends']:
+            visit(d, path + [name])
+        state[name] = 'done'
+    for name in steps:
+        visit(name, [])
+
+
+def _resolve(value, outputs):
+    """Substitute '@step' outputs and {'env': NAME} values into arguments"""
+    if isinstance(value, str) and value.startswith('@'):
+        out = outputs[value[1:]]
+        # Several pyEDIutils functions modify dataframes in place, so give
+        # each consumer its own copy
+        return out.copy() if isinstance(out, pd.DataFrame) else out
+    if isinstance(value, dict):
+        if set(value) == {'env'}:
+            return os.environ[value['env']]
+        return {k: _resolve(v, outputs) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_resolve(v, outputs) for v in value]
+    return value
+
+
+def _resolve_call(call):
+    """Import 'module.function' from pyEDIutils"""
+    module, func = call.rsplit('.', 1)
+    return getattr(importlib.import_module('pyEDIutils.' + module), func)
+
+
+def step_keys(steps):
+    """Hash each step's definition together with its upstream hashes
+
+    A step's checkpoint is only reused when its key is unchanged, so editing
+    a step also invalidates everything downstream of it.
+    """
+    keys = {}
+    def key(name):
+        if name not in keys:
+            step = steps[name]
+            h = hashlib.sha256(json.dumps(
+                {k: step.get(k) for k in ('call', 'args', 'depends')},
+                sort_keys=True, default=str).encode())
+            for d in step['depends']:
+                h.update(key(d).encode())
+            keys[name] = h.hexdigest()
+        return keys[name]
+    for name in steps:
+        key(name)
+    return(keys)
+
+
+def _checkpoint_path(workdir, name):
+    return os.path.join(workdir, '.checkpoints', name + '.pkl')
+
+
+def _load_checkpoint(workdir, name, key):
+    path = _checkpoint_path(workdir, name)
+    if not os.path.exists(path):
+        return(False, None)
+    with open(path, 'rb') as f:
+        saved = pickle.load(f)
+    if saved.get('key') != key:
+        return(False, None)
+    return(True, saved['output'])
+
+
+def _save_checkpoint(workdir, name, key, output):
+    path = _checkpoint_path(workdir, name)
+    tmp_path = path + '.part'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({'key': key, 'output': output}, f)
+    os.replace(tmp_path, path)
+
+
+def _write_output(workdir, filename, output):
+    path = os.path.join(workdir, filename)
+    if isinstance(output, pd.DataFrame):
+        if path.endswith('.pkl'):
+            output.to_pickle(path)
+        else:
+            output.to_csv(path)
+    else:
+        with open(path, 'w') as f:
+            f.write(output if isinstance(output, str) else
+                    json.dumps(output, indent=2, default=str))
+
+
+def _run_step(step, outputs):
+    func = _resolve_call(step['call'])
+    args = _resolve(step.get('args', {}), outputs)
+    start = time.perf_counter()
+    output = func(**args)
+    return(output, time.perf_counter() - start)
+
+
+def run_manifest(manifest, workers=4, force=False):
+    """Run the steps of a job manifest, in parallel where possible
+
+    Parameters
+    ----------
+    manifest : str or dict
+        path to a JSON manifest, or a manifest dict (a relative workdir is
+        then taken relative to the current directory)
+    workers : int, optional
+        maximum number of steps to run at once, by default 4
+    force : bool, optional
+        ignore existing checkpoints and rerun every step, by default False
+
+    Returns
+    -------
+    tuple
+        (dict of step outputs, dataframe with status and seconds per step)
+    """
+    if isinstance(manifest, str):
+        manifest = load_manifest(manifest)
+    else:
+        manifest = normalize_manifest(manifest)
+    steps = manifest['steps']
+    workdir = manifest['workdir']
+    os.makedirs(os.path.join(workdir, '.checkpoints'), exist_ok=True)
+    keys = step_keys(steps)
+    outputs = {}
+    summary = {}
+    # Reuse checkpoints from earlier runs
+    if not force:
+        for name in steps:
+            found, output = _load_checkpoint(workdir, name, keys[name])
+            if found:
+                print('Step {0}: using checkpoint'.format(name))
+                outputs[name] = output
+                summary[name] = ('checkpoint', 0.0)
+                # Restore a declared output file deleted since the last run
+                filename = steps[name].get('output')
+                if (filename is not None and
+                        not os.path.exists(os.path.join(workdir, filename))):
+                    _write_output(workdir, filename, output)
+    # Share one session and response cache across all steps, leaving a
+    # cache the caller already enabled in place afterwards
+    cache_was_enabled = th.cache_enabled()
+    th.enable_cache()
+    failed = None
+    running = {}
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                if failed is None:
+                    for name, step in steps.items():
+                        if (name not in outputs and name not in running and
+                                name not in summary and
+                                all(d in outputs for d in step['depends'])):
+                            print('Step {0}: starting {1}'.format(
+                                name, step['call']))
+                            running[name] = pool.submit(_run_step, step,
+                                                        outputs)
+                if not running:
+                    break
+                done, _ = wait(list(running.values()),
+                               return_when=FIRST_COMPLETED)
+                for name in [n for n, fut in running.items() if fut in done]:
+                    fut = running.pop(name)
+                    try:
+                        output, seconds = fut.result()
+                    except Exception as e:
+                        print('Step {0}: failed ({1!r})'.format(name, e))
+                        summary[name] = ('failed', float('nan'))
+                        if failed is None:
+                            failed = e
+                        continue
+                    outputs[name] = output
+                    summary[name] = ('done', seconds)
+                    _save_checkpoint(workdir, name, keys[name], output)
+                    if 'output' in steps[name]:
+                        _write_output(workdir, steps[name]['output'], output)
+                    print('Step {0}: done in {1:.1f}s'.format(name, seconds))
+    finally:
+        if not cache_was_enabled:
+            th.disable_cache()
+    for name in steps:
+        summary.setdefault(name, ('skipped', float('nan')))
+    df_timing = pd.DataFrame.from_dict(summary, orient='index',
+                                       columns=['status', 'seconds'])
+    df_timing.index.name = 'step'
+    print(df_timing.to_string())
+    print('Total wall time {0:.1f}s'.format(time.perf_counter() - start))
+    if failed is not None:
+        raise failed
+    return(outputs, df_timing)
+
+
+def main(argv=None):
+    """Command line entry point ('pyediutils')"""
+    parser = argparse.ArgumentParser(prog='pyediutils',
+        description='Run pyEDIutils job manifests.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    run = sub.add_parser('run', help='run a JSON job manifest')
+    run.add_argument('manifest', help='path to the manifest file')
+    run.add_argument('--workers', type=int, default=4,
+        help='maximum number of steps to run at once (default 4)')
+    run.add_argument('--force', action='store_true',
+        help='ignore checkpoints and rerun every step')
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        run_manifest(args.manifest, workers=args.workers, force=args.force)
+
+
+if __name__ == '__main__':
+    main()
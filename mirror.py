@@ -0,0 +1,256 @@
+import pyEDIutils.pasta_api_requests as rq
+import pyEDIutils.search as search
+import pyEDIutils.download as dl
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import shutil
+import time
+
+
+def load_mirror_manifest(mirror_dir):
+    """Load the mirror manifest, or an empty one for a new mirror
+
+    The manifest maps 'scope.identifier.revision/entityid' keys to the local
+    path (relative to mirror_dir), SHA-1 and size of each mirrored entity
+    ('entities'), and each package revision already listed to its entity
+    records ('packages'), so revisions are only listed once.
+
+    Parameters
+    ----------
+    mirror_dir : str
+        path to the local mirror directory
+    """
+    path = os.path.join(mirror_dir, 'manifest.json')
+    if not os.path.exists(path):
+        return({'entities': {}, 'packages': {}})
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    manifest.setdefault('packages', {})
+    return(manifest)
+
+
+def save_mirror_manifest(mirror_dir, manifest):
+    """Write the mirror manifest atomically"""
+    path = os.path.join(mirror_dir, 'manifest.json')
+    with open(path + '.part', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + '.part', path)
+
+
+def scope_entities(query='scope:knb-lter-jrn', rows=10000, max_workers=8,
+                   known=None, failed=None):
+    """List every data entity, with its PASTA checksum, for a package search
+
+    PASTA package revisions are immutable, so entity listings for revisions
+    in `known` are reused and only new revisions are requested.
+
+    Parameters
+    ----------
+    query : str or list of strings, optional
+        solr query selecting the packages, by default 'scope:knb-lter-jrn'
+    rows : int, optional
+        maximum number of packages to return from the search, by default 10000
+    max_workers : int, optional
+        number of concurrent metadata requests, by default 8
+    known : dict, optional
+        {packageid: list of entity records} for revisions listed before
+        (the mirror manifest's 'packages'); listings of new revisions are
+        added to it as they complete, by default None
+    failed : list, optional
+        packageids that could not be listed (e.g. an error response for a
+        restricted entity) are appended to it, by default None. These
+        packages are left out of the result and listed again next time.
+
+    Returns
+    -------
+    dataframe
+        one row per entity with scope, identifier, revision, entityid,
+        entityname and sha1 columns
+    """
+    df_pkgs = search.search_pasta(query=query, fields=['packageid'],
+                                  rows=rows)
+    if known is None:
+        known = {}
+    pkgids = [p.split('.') for p in df_pkgs.packageid if p not in known]
+    dfs = [pd.DataFrame(known[p], columns=['scope', 'identifier', 'revision',
+        'entityid', 'entityname', 'sha1'])
+        for p in df_pkgs.packageid if p in known]
+
+    if failed is None:
+        failed = []
+
+    def entities(pkg):
+        scope, identifier, revision = pkg
+        try:
+            df = rq.pkg_entity_names(scope, identifier, revision)
+            df.insert(0, 'revision', revision)
+            df.insert(0, 'identifier', identifier)
+            df.insert(0, 'scope', scope)
+            df['sha1'] = [rq.pkg_entity_checksum(scope, identifier, revision,
+                          e) for e in df.entityid]
+        except Exception as e:
+            # One package that cannot be listed should not stop the others
+            print('Listing {0} failed: {1!r}'.format('.'.join(pkg), e))
+            failed.append('.'.join(pkg))
+            return(None)
+        known['.'.join(pkg)] = df.to_dict('records')
+        return(df)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        new = [df for df in pool.map(entities, pkgids) if df is not None]
+    dfs += new
+    print('Listed entities for {0} new package revisions, {1} known, {2} '
+          'failed'.format(len(new), len(df_pkgs) - len(pkgids), len(failed)))
+    if not dfs:
+        return(pd.DataFrame(columns=['scope', 'identifier', 'revision',
+            'entityid', 'entityname', 'sha1']))
+    return(pd.concat(dfs, ignore_index=True))
+
+
+def _link_or_copy(src, dst):
+    """Hardlink src to dst, falling back to a copy across filesystems"""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def sync_mirror(mirror_dir, query='scope:knb-lter-jrn', rows=10000,
+                max_workers=4, max_bps=None):
+    """Bring a local mirror of PASTA data entities up to date
+
+    Entities for the packages matching `query` are compared with the mirror
+    manifest by PASTA's SHA-1 checksum. Revisions listed in an earlier sync
+    are not requested again, so the number of PASTA calls scales with the
+    new revisions only. Entities already mirrored with the
+    same checksum are skipped, entities whose content exists under another
+    revision are hardlinked to that file, and only the rest are downloaded.
+    Files are stored as '<mirror_dir>/<scope>/<identifier>/<revision>/
+    <entityid>'.
+
+    Parameters
+    ----------
+    mirror_dir : str
+        path to the local mirror directory
+    query : str or list of strings, optional
+        solr query selecting the packages, by default 'scope:knb-lter-jrn'
+    rows : int, optional
+        maximum number of packages to return from the search, by default 10000
+    max_workers : int, optional
+        number of simultaneous downloads, by default 4
+    max_bps : float, optional
+        cap on combined download bytes per second, by default None
+
+    Returns
+    -------
+    dataframe
+        one row per entity with the action taken ('unchanged', 'linked',
+        'downloaded' or 'failed') and its size in bytes, plus a 'failed'
+        row (with no entityid) for each package that could not be listed
+    """
+    start = time.perf_counter()
+    os.makedirs(mirror_dir, exist_ok=True)
+    manifest = load_mirror_manifest(mirror_dir)
+    mirrored = manifest['entities']
+    # Index existing files by checksum to find content shared by revisions
+    by_sha1 = {}
+    for rec in mirrored.values():
+        if os.path.exists(os.path.join(mirror_dir, rec['path'])):
+            by_sha1[rec['sha1']] = rec
+    # The manifest is saved however the sync ends, keeping the listings
+    # and downloads completed so far
+    try:
+        # Listings of new revisions are added to manifest['packages']
+        failed = []
+        df = scope_entities(query=query, rows=rows,
+                            known=manifest['packages'], failed=failed)
+        df['key'] = (df.scope + '.' + df.identifier + '.' + df.revision + '/' +
+                     df.entityid)
+        df['path'] = [os.path.join(s, i, r, e) for s, i, r, e in
+                      zip(df.scope, df.identifier, df.revision, df.entityid)]
+        df['action'] = ''
+        df['bytes'] = 0
+        to_download = []
+        # Entities sharing content with one already queued are linked
+        # afterwards
+        queued = {}
+        to_link = []
+        for i, row in df.iterrows():
+            rec = mirrored.get(row.key)
+            if (rec is not None and rec['sha1'] == row.sha1 and
+                    os.path.exists(os.path.join(mirror_dir, rec['path']))):
+                df.loc[i, ['action', 'bytes']] = ['unchanged', rec['bytes']]
+            elif row.sha1 in by_sha1:
+                src = by_sha1[row.sha1]
+                dst = os.path.join(mirror_dir, row.path)
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                _link_or_copy(os.path.join(mirror_dir, src['path']), dst)
+                mirrored[row.key] = {'path': row.path, 'sha1': row.sha1,
+                                     'bytes': src['bytes']}
+                df.loc[i, ['action', 'bytes']] = ['linked', src['bytes']]
+            elif row.sha1 in queued:
+                to_link.append(i)
+            else:
+                queued[row.sha1] = i
+                to_download.append(i)
+        # Download the remaining entities in parallel
+        limiter = dl.BandwidthLimiter(max_bps) if max_bps else None
+
+        def fetch(i):
+            row = df.loc[i]
+            dst = os.path.join(mirror_dir, row.path)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            try:
+                out = dl.download_entity(row.scope, row.identifier,
+                    row.revision, row.entityid, dst, limiter=limiter,
+                    checksum=row.sha1)
+            except Exception as e:
+                print('Mirror download of {0} failed: {1!r}'.format(
+                    row.key, e))
+                return(i, None)
+            return(i, os.path.getsize(out['path']))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for i, nbytes in pool.map(fetch, to_download):
+                if nbytes is None:
+                    df.loc[i, 'action'] = 'failed'
+                    continue
+                row = df.loc[i]
+                mirrored[row.key] = {'path': row.path, 'sha1': row.sha1,
+                                     'bytes': nbytes}
+                by_sha1.setdefault(row.sha1, mirrored[row.key])
+                df.loc[i, ['action', 'bytes']] = ['downloaded', nbytes]
+        for i in to_link:
+            row = df.loc[i]
+            src = by_sha1.get(row.sha1)
+            if src is None:
+                df.loc[i, 'action'] = 'failed'
+                continue
+            dst = os.path.join(mirror_dir, row.path)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            _link_or_copy(os.path.join(mirror_dir, src['path']), dst)
+            mirrored[row.key] = {'path': row.path, 'sha1': row.sha1,
+                                 'bytes': src['bytes']}
+            df.loc[i, ['action', 'bytes']] = ['linked', src['bytes']]
+        # Packages that could not be listed are reported as failed
+        if failed:
+            df = pd.concat([df, pd.DataFrame({
+                'scope': [p.split('.')[0] for p in failed],
+                'identifier': [p.split('.')[1] for p in failed],
+                'revision': [p.split('.')[2] for p in failed],
+                'action': 'failed', 'bytes': 0})], ignore_index=True)
+    finally:
+        save_mirror_manifest(mirror_dir, manifest)
+    # Report
+    counts = df.action.value_counts()
+    moved = df.loc[df.action == 'downloaded', 'bytes'].sum()
+    saved = df.loc[df.action.isin(['unchanged', 'linked']), 'bytes'].sum()
+    print('Mirror sync of {0} entities in {1:.1f}s: {2}'.format(len(df),
+        time.perf_counter() - start,
+        ', '.join('{0} {1}'.format(n, a) for a, n in counts.items())))
+    print('{0:,} bytes downloaded, {1:,} bytes saved'.format(moved, saved))
+    return(df.drop(columns='key'))
@@ -1,36 +1,58 @@
-import requests
+import pyEDIutils.throttle as th
 from requests.compat import urljoin
-import xml.etree.ElementTree as ET
+import pyEDIutils.xmlparse as xp
+import pyEDIutils.auth as auth
 import pandas as pd
+import gzip
 import os
 
+# Base URLs of the PASTA package and audit managers (override to use
+# another server)
+PACKAGE_URL = 'https://pasta.lternet.edu/package/'
+AUDIT_URL = 'https://pasta.lternet.edu/audit/'
+
 def archived_response_to_ET(xmlname):
     """
     Load an archived python request xml file and return it as an ElementTree
+    (parsed with lxml if installed, see xmlparse)
 
     Parameters
     ----------
     xmlname : string
-        filename and path to a stored response file
+        filename and path to a stored response file, which may be gzip
+        compressed (ending in '.gz')
     """
-    tree = ET.parse(xmlname)
-    root = tree.getroot()
+    if xmlname.endswith('.gz'):
+        with gzip.open(xmlname, 'rb') as f:
+            root = xp.parse(f)
+    else:
+        root = xp.parse(xmlname)
     return(root)
 
 def response_to_ET(response):
     """
-    Return the response from a PASTA request as an ElementTree
+    Return the response from a PASTA request as an ElementTree (parsed with
+    lxml if installed, see xmlparse). The raw bytes are parsed so the
+    encoding declared in the XML is honored.
 
     Parameters
     ----------
     response : string
         A response from a python request to the PASTA API
+
+    Raises
+    ------
+    requests.HTTPError
+        If PASTA returned an error status (e.g. after retries on 429/503
+        were exhausted), rather than failing to parse the error page as XML
     """
-    root = ET.fromstring(response.text)
+    response.raise_for_status()
+    root = xp.fromstring(response.content)
     return(root)
 
 
-def pasta_solr_search(fqs, fls, sort, rows, env='production'):
+def pasta_solr_search(fqs, fls, sort, rows, env='production',
+                      facet_fields=None, facet_ranges=None, facet_mincount=1):
     """
     Make python requests to the PASTA _search data packages_ API call.
 
@@ -54,6 +76,18 @@ def pasta_solr_search(fqs, fls, sort, rows, env='production'):
         Number of rows to include in response
     env : str, optional
         PASTA environment to search, by default 'production'
+    facet_fields : string list, optional
+        Fields to return facet (value count) lists for, by default None
+    facet_ranges : dict, optional
+        Range facets as {field: (start, end, gap)}, for example
+        {'pubdate': ('2000-01-01T00:00:00Z', 'NOW', '+1YEAR')}, by default
+        None
+    facet_mincount : int, optional
+        Smallest count to include in facet results, by default 1
+
+    PASTA wraps Solr's results in its own <resultset> and has not been seen
+    to return the facet section, so search.facet_pasta counts facets locally
+    rather than relying on the facet parameters.
     """
     if env=='staging':
         base_url = 'https://pasta-s.lternet.edu/package/search/eml'
@@ -67,12 +101,26 @@ def pasta_solr_search(fqs, fls, sort, rows, env='production'):
         ('fl', fls),
         ('sort', sort),
         ('rows', rows))
-    response = requests.get(base_url, params=params)
+    # Solr faceting parameters
+    if facet_fields or facet_ranges:
+        params += (
+            ('facet', 'true'),
+            ('facet.limit', -1),
+            ('facet.mincount', facet_mincount))
+        for f in (facet_fields or []):
+            params += (('facet.field', f),)
+        for f, (start, end, gap) in (facet_ranges or {}).items():
+            params += (
+                ('facet.range', f),
+                ('f.{0}.facet.range.start'.format(f), start),
+                ('f.{0}.facet.range.end'.format(f), end),
+                ('f.{0}.facet.range.gap'.format(f), gap))
+    response = th.get(base_url, params=params)
     # Print out the request url
     print(response.request.url)
     return(response)
 
-def recent_changes(scope, fromdt, todt=None):
+def recent_changes(scope, fromdt, todt=None, stream=False):
     """The _list recent changes_ PASTA API request. It returns an xml
     response populated with operations in the PASTA database.
 
@@ -88,6 +136,10 @@ def recent_changes(scope, fromdt, todt=None):
         Starting datetime for the request (YYYY-MM-DD)
     todt : string, optional
         Ending datetime for the request (YYYY-MM-DD), by default None
+    stream : bool, optional
+        Leave the body unread so it can be consumed in chunks with
+        `response.iter_content` (requests already asks for gzip encoding),
+        by default False
     """
     if todt is None:
         from datetime import datetime
@@ -97,7 +149,7 @@ def recent_changes(scope, fromdt, todt=None):
         ('fromDate', fromdt),
         ('toDate', todt),
         ('scope', scope))
-    response = requests.get(base_url, params=params)
+    response = th.get(base_url, params=params, stream=stream)
     # Print out the request url
     print(response.request.url)
     return(response)
@@ -126,9 +178,11 @@ def pkg_entity_names(scope, identifier, revision):
     base_url = 'https://pasta.lternet.edu/package/name/eml/'
     rq_url = urljoin(base_url, '/'.join([scope, identifier, revision]))
     # Request
-    response = requests.get(rq_url)
+    response = th.get(rq_url)
     # Print out the request url
     print(response.request.url)
+    # An error page would otherwise be parsed as entity names
+    response.raise_for_status()
     # Parse the csv and return a dataframe
     l1 = response.text.split('\n')[0:-1]
     l2 = [l1[i].split(',', 1) for i in range(0, len(l1))]
@@ -162,13 +216,79 @@ def pkg_entity_metadata(scope, identifier, revision, entityid):
     rq_url = urljoin(base_url, '/'.join([scope, identifier,
         revision, entityid]))
     # Request
-    response = requests.get(rq_url)
+    response = th.get(rq_url)
     # Print out the request url and return ET root
     print(response.request.url)
     
     return(response)
 
 
+def pkg_entity_checksum(scope, identifier, revision, entityid):
+    """Request the SHA-1 checksum PASTA stores for a data entity.
+
+    https://pastaplus-core.readthedocs.io/en/latest/doc_tree/pasta_api/data_package_manager_api.html#read-data-entity-checksum
+
+    Parameters
+    ----------
+    scope : string
+        EDI scope for the request
+    identifier : int
+        Data package identifier
+    revision : int
+        Revision number of the data package
+    entityid : string
+        identifier hash for the entity in PASTA
+
+    Returns
+    -------
+    str
+        SHA-1 hex digest of the entity data
+    """
+    # Create the URL
+    base_url = PACKAGE_URL + 'data/checksum/eml/'
+    rq_url = urljoin(base_url, '/'.join([scope, str(identifier),
+        str(revision), entityid]))
+    # Request, print return
+    response = th.get(rq_url)
+    print(response.request.url)
+    response.raise_for_status()
+    return(response.text.strip())
+
+def pkg_entity_data(scope, identifier, revision, entityid, offset=0):
+    """Request the data for a data entity as a streamed response.
+
+    The body is left unread so it can be consumed in chunks (for example with
+    `response.iter_content`). A nonzero offset sends an HTTP Range request
+    for the remainder of the entity; check for status 206 to confirm the
+    server honored it.
+
+    https://pastaplus-core.readthedocs.io/en/latest/doc_tree/pasta_api/data_package_manager_api.html#read-data-entity
+
+    Parameters
+    ----------
+    scope : string
+        EDI scope for the request
+    identifier : int
+        Data package identifier
+    revision : int
+        Revision number of the data package
+    entityid : string
+        identifier hash for the entity in PASTA
+    offset : int, optional
+        byte offset to start from, by default 0
+    """
+    # Create the URL
+    base_url = PACKAGE_URL + 'data/eml/'
+    rq_url = urljoin(base_url, '/'.join([scope, str(identifier),
+        str(revision), entityid]))
+    headers = {'Accept-Encoding': 'identity'}
+    if offset > 0:
+        headers['Range'] = 'bytes={0}-'.format(offset)
+    # Request, print return
+    response = th.get(rq_url, headers=headers, stream=True)
+    print(response.request.url)
+    return(response)
+
 def pkg_revisions(identifier, scope='knb-lter-jrn', filt='newest'):
     """Request the package revision numbers for a package in PASTA.
     
@@ -196,7 +316,7 @@ def pkg_revisions(identifier, scope='knb-lter-jrn', filt='newest'):
         ('filter', filt),
     )
     # Request, print return
-    response = requests.get(rq_url, params=params)
+    response = th.get(rq_url, params=params)
     print(response.request.url)
     if filt is not None:
         return response.text
@@ -222,7 +342,7 @@ def aud_document(identifier, scope='knb-lter-jrn'):
     base_url = 'https://pasta.lternet.edu/audit/reads/'
     rq_url = urljoin(base_url, '/'.join([scope, str(identifier)]))
     # Request, print return
-    response = requests.get(rq_url)#, params=params)
+    response = th.get(rq_url)#, params=params)
     print(response.request.url)
     return(response)
 
@@ -248,13 +368,13 @@ def aud_package(scope, identifier, revision):
     base_url = 'https://pasta.lternet.edu/audit/reads/'
     rq_url = urljoin(base_url, '/'.join([scope, str(identifier), str(rev)]))
     # Request print return
-    response = requests.get(rq_url)#, params=params)
+    response = th.get(rq_url)#, params=params)
     print(response.request.url)
     return(response)
 
 
 def aud_report_dpm(servmethod, user, group, resid, fromdt, todt, lim,
-                   dn, pw):
+                   dn, pw, base_url=AUDIT_URL, login_url=auth.LOGIN_URL):
     """Get an audit report from the PASTA data package manager
 
     Parameters
@@ -273,14 +393,18 @@ def aud_report_dpm(servmethod, user, group, resid, fromdt, todt, lim,
         [description]
     lim : [type]
         [description]
-    dn : [type]
-        [description]
-    pw : [type]
-        [description]
+    dn : str
+        Distinguished name; PASTA is logged in to once per dn/pw and the
+        auth-token reused for later calls (see auth.get_session)
+    pw : str
+        Password for dn
+    base_url : str, optional
+        audit manager URL, by default AUDIT_URL
+    login_url : str, optional
+        URL used to obtain the auth-token, by default auth.LOGIN_URL
     """
     # Create the URL
-    base_url = 'https://pasta.lternet.edu/audit/report/'
-    rq_url = base_url
+    rq_url = base_url + 'report/'
     # Parameters
     params = (
         ('category', 'info'),
@@ -295,12 +419,14 @@ def aud_report_dpm(servmethod, user, group, resid, fromdt, todt, lim,
         ('limit', lim)
     )
     # Request, print return
-    response = requests.get(rq_url, params=params, auth=(dn, pw))
+    # Authenticate with a reused auth-token rather than basic auth
+    response = auth.get_session(dn, pw, login_url=login_url).get(
+        rq_url, params=params)
     print(response.request.url)
     return(response)
 
 def aud_count_dpm(servmethod, user, group, resid, fromdt, todt, lim,
-                  dn, pw):
+                  dn, pw, base_url=AUDIT_URL, login_url=auth.LOGIN_URL):
     """Get an audit count from the PASTA data package manager
 
     Parameters
@@ -319,14 +445,18 @@ def aud_count_dpm(servmethod, user, group, resid, fromdt, todt, lim,
         [description]
     lim : [type]
         [description]
-    dn : [type]
-        [description]
-    pw : [type]
-        [description]
+    dn : str
+        Distinguished name; PASTA is logged in to once per dn/pw and the
+        auth-token reused for later calls (see auth.get_session)
+    pw : str
+        Password for dn
+    base_url : str, optional
+        audit manager URL, by default AUDIT_URL
+    login_url : str, optional
+        URL used to obtain the auth-token, by default auth.LOGIN_URL
     """
     # Create the URL
-    base_url = 'https://pasta.lternet.edu/audit/count/'
-    rq_url = base_url
+    rq_url = base_url + 'count/'
     # Parameters
     params = (
         ('category', 'info'),
@@ -341,6 +471,8 @@ def aud_count_dpm(servmethod, user, group, resid, fromdt, todt, lim,
         ('limit', lim)
     )
     # Request, print return
-    response = requests.get(rq_url, params=params, auth=(dn, pw))
+    # Authenticate with a reused auth-token rather than basic auth
+    response = auth.get_session(dn, pw, login_url=login_url).get(
+        rq_url, params=params)
     print(response.request.url)
     return(response)
@@ -1,4 +1,5 @@
 import pyEDIutils.pasta_api_requests as rq
+import pyEDIutils.xmlparse as xp
 import pandas as pd
 import pdb
 
@@ -22,9 +23,11 @@ def entity_table(scope, identifier, revision):
     # Loop through entity ids and add filename, entitytypes and filetypes.
     for i, e in enumerate(df.entityid):
         # request metadata for the entity
-        metaroot = rq.pkg_entity_metadata(scope, identifier, revision, e)
-        df.loc[i,'filename'] = metaroot.find('./fileName').text
-        if metaroot.find('./dataFormat').text=='text/csv':
+        metaroot = rq.response_to_ET(
+            rq.pkg_entity_metadata(scope, identifier, revision, e))
+        meta = xp.extract(metaroot, xp.SCHEMAS['entity_metadata'])
+        df.loc[i,'filename'] = meta['fileName'][0]
+        if meta['dataFormat'][0]=='text/csv':
                 df.loc[i,'entitytype'] = 'dataTable'
                 df.loc[i, 'filetype'] = 'csv_D'
     # Return the dataframe
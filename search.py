@@ -1,10 +1,13 @@
 import pyEDIutils.pasta_api_requests as rq
+import pyEDIutils.xmlparse as xp
 import pandas as pd
+import numpy as np
 import os
+import re
 import pdb
 
     
-def searchroot_to_df(root, fields):
+def searchroot_to_df(root, fields, explode=False):
     """Convert PAST solr search result to a dataframe
 
     Convert a returned ElementTree object from a PASTA solr search to a
@@ -19,34 +22,104 @@ def searchroot_to_df(root, fields):
     fields : string list
         A list of field names PASTA returned in the query, which will become
         columns in the dataframe
+    explode : bool, optional
+        Also return long keyword/author tables and an inverted index, built
+        in the same pass (see below), by default False
+
+    Returns
+    -------
+    dataframe or (dataframe, dict)
+        The search dataframe and, if explode is True, a dict with a long
+        table per multifield ('keywords', 'authors'; columns 'row', the
+        term as a categorical, and 'packageid' if requested; one row per
+        distinct term in each document) and 'index',
+        which maps each multifield to a {term: array of dataframe rows}
+        inverted index (see search_terms)
     """
     dfill = {}
+    terms = {}
+    # Single-valued fields are extracted together in one pass
+    cols = xp.extract(root, [f for f in fields
+        if f not in ('keyword', 'author', 'coordinates')])
     for f in fields:
         if (f=='keyword' or f=='author'):
-            dfill[f+'s'] = [';'.join([v.text for v in vs.iter(f)]) 
-                    for vs in root.iter(f+'s')]
+            joined = []
+            rows, vals, index = [], [], {}
+            for i, vs in enumerate(root.iter(f+'s')):
+                texts = [v.text for v in vs.iter(f)]
+                joined.append(';'.join(texts))
+                if explode:
+                    # A term repeated within one document is kept once, in
+                    # both the long table and the index
+                    unique = list(dict.fromkeys(texts))
+                    rows.extend([i] * len(unique))
+                    vals.extend(unique)
+                    for t in unique:
+                        index.setdefault(t, []).append(i)
+            dfill[f+'s'] = joined
+            if explode:
+                terms[f] = (rows, vals, index)
         elif f=='coordinates':
             # The solr search sends back a set of coordinates for each
             # geographicCoverage element, so if there are multiple elements
             # fdthis will create a column that exceeds the number of datasetids
-            # Not sure how to parse these multiple returns yet, so just
-            # counting them here.
-            #dfill[f] = [';'.join([v.text for v in vs.iter(f)]) 
-            #        for vs in root.iter(f)]
+            # Only count them here; searchroot_to_coords returns them as a
+            # long table keyed by packageid.
             print('More than 1 spatial entity per packageid, so just counting')
             dfill[f + '_ent'] = [len(sc.findall('coordinates'))
                 for sc in root.iter('spatialCoverage')]
         else:
-            dfill[f] = [v.text for v in root.iter(f)]
+            dfill[f] = cols[f]
     # Make a dataframe from dfill
     df = pd.DataFrame(dfill)
-    return(df)
+    if not explode:
+        return(df)
+    tables = {'index': {}}
+    for f, (rows, vals, index) in terms.items():
+        rows = np.array(rows, dtype=np.intp)
+        long = pd.DataFrame({'row': rows, f: pd.Categorical(vals)})
+        if 'packageid' in df:
+            long.insert(0, 'packageid',
+                        pd.Categorical(df['packageid'].to_numpy()[rows]))
+        tables[f+'s'] = long
+        tables['index'][f] = {t: np.array(r, dtype=np.intp)
+                              for t, r in index.items()}
+    return(df, tables)
+
+
+def search_terms(df, tables, field, term):
+    """Rows of a search dataframe with a given keyword or author
+
+    Uses the inverted index from searchroot_to_df(..., explode=True), so
+    this is a dictionary lookup instead of a string scan of the column.
+
+    Parameters
+    ----------
+    df : dataframe
+        Search dataframe from searchroot_to_df or search_pasta
+    tables : dict
+        Term tables returned alongside df when explode=True
+    field : str
+        'keyword' or 'author'
+    term : str
+        Exact keyword or author name
+
+    Raises
+    ------
+    ValueError
+        if `field` was not requested in the exploded search
+    """
+    if field not in tables.get('index', {}):
+        raise ValueError('No {0} index in the search tables; include {0!r} '
+            'in the fields of an explode=True search'.format(field))
+    rows = tables['index'][field].get(term, np.array([], dtype=np.intp))
+    return(df.iloc[rows])
                       
 
         
 def search_pasta(query='scope:knb-lter-jrn',
-        fields=['packageid','doi','title','pubdate'],
-        sortby='packageid,asc', rows=500, returnroot=False):
+        fields=xp.SCHEMAS['search'],
+        sortby='packageid,asc', rows=500, returnroot=False, explode=False):
     """Search packages in PASTA
     
     This searches packages across a variety of fields using the Apache solr
@@ -66,19 +139,24 @@ def search_pasta(query='scope:knb-lter-jrn',
     query : str or list of strings, optional
         A string or list of query terms (field:term), by default 'scope:knb-lter-jrn'
     fields : list, optional
-        List of fields to return from the search, by default 
-        ['packageid','doi','title','pubdate']
+        List of fields to return from the search, by default
+        xmlparse.SCHEMAS['search'] ('packageid', 'doi', 'title', 'pubdate')
     sortby : str, optional
         List of  fields to sort result by, by default 'packageid,asc'
     rows : int, optional
         number of rows to return, by default 500
     returnroot : bool, optional
         Flag to return ElementTree root instead of dataframe, by default False
+    explode : bool, optional
+        Also return long keyword/author tables and their inverted index
+        (see searchroot_to_df), by default False
 
     Returns
     -------
-    dataframe or (dataframe, root)
-        Returns either a dataframe or a dataframe and ElementTree root object
+    dataframe, (dataframe, root), (dataframe, tables) or
+    (dataframe, tables, root)
+        Returns a dataframe, the term tables if explode is True, and the
+        ElementTree root object if returnroot is True
     """
     # fq must be a 'field:queryterm' or list of 'field:queryterm'
     # possible fields are 'scope', 'author', 'title', 'packageid', etc
@@ -92,9 +170,365 @@ def search_pasta(query='scope:knb-lter-jrn',
     response = rq.pasta_solr_search(fq, fl, sort, rows)
     root = rq.response_to_ET(response)
     # Convert elements to rows in dataframe
-    df_out = searchroot_to_df(root, fields)
+    df_out = searchroot_to_df(root, fields, explode=explode)
+    if explode and returnroot:
+        return df_out + (root,)
+    elif returnroot:
+        return (df_out, root)
+    else:
+        return df_out
+
+
+def facetroot_to_df(root):
+    """Convert the facet counts in a PASTA solr search result to a dataframe
+
+    Reads Solr's 'facet_counts' section (field and range facets) from a
+    returned ElementTree object into a tidy dataframe with one row per
+    facet value. PASTA's search service wraps Solr results in its own
+    <resultset> and does not pass this section on, so this only applies to
+    Solr-native responses; facet_pasta counts locally instead.
+
+    Parameters
+    ----------
+    root : ElementTree object
+        An ElementTree object returned from a PASTA solr search made with
+        facet parameters
+
+    Returns
+    -------
+    dataframe
+        columns 'facet' (field name), 'type' ('field' or 'range'), 'value'
+        and 'count'
+
+    Raises
+    ------
+    ValueError
+        if the response has no 'facet_counts' section, i.e. the server
+        did not return Solr's facet results (an empty frame would be
+        indistinguishable from a facet with no values)
+    """
+    dfill = {'facet':[], 'type':[], 'value':[], 'count':[]}
+    found = False
+    def add(field, ftype, counts):
+        for c in counts:
+            if c.tag in ('int', 'long'):
+                dfill['facet'].append(field)
+                dfill['type'].append(ftype)
+                dfill['value'].append(c.get('name'))
+                dfill['count'].append(int(c.text))
+    for fc in root.iter('lst'):
+        if fc.get('name') != 'facet_counts':
+            continue
+        found = True
+        for section in fc:
+            if section.get('name') == 'facet_fields':
+                for field in section:
+                    add(field.get('name'), 'field', field)
+            elif section.get('name') == 'facet_ranges':
+                for field in section:
+                    for counts in field:
+                        if counts.get('name') == 'counts':
+                            add(field.get('name'), 'range', counts)
+    if not found:
+        raise ValueError('No facet_counts in the search response (root '
+            'element <{0}>); the server did not return facet results. Use '
+            'facet_pasta, which counts the values locally.'.format(
+            root.tag))
+    df = pd.DataFrame(dfill)
+    return(df)
+
+
+_GAP_UNITS = {'YEAR': 'years', 'MONTH': 'months', 'DAY': 'days',
+              'HOUR': 'hours', 'MINUTE': 'minutes', 'SECOND': 'seconds'}
+
+
+def _range_bins(start, end, gap):
+    """Bin edges for a range facet, as Solr would lay them out
+
+    Numeric gaps give numeric bins. Otherwise start and end are dates (ISO
+    strings or 'NOW') and gap is Solr date math such as '+1YEAR' or
+    '+6MONTHS'. Returns (left edges, right edges, labels); the last bin may
+    extend past `end`, as with Solr's default (facet.range.hardend=false).
+    """
+    try:
+        gap = float(gap)
+    except ValueError:
+        m = re.match(r'^\+?(\d+)(YEAR|MONTH|DAY|HOUR|MINUTE|SECOND)S?$',
+                     str(gap).strip().upper())
+        if m is None:
+            raise ValueError('Unsupported range facet gap: {0}'.format(gap))
+        step = pd.DateOffset(**{_GAP_UNITS[m.group(2)]: int(m.group(1))})
+        def when(t):
+            if str(t).strip().upper() == 'NOW':
+                return(pd.Timestamp.now(tz='UTC'))
+            return(pd.Timestamp(t).tz_localize('UTC') if
+                   pd.Timestamp(t).tzinfo is None else pd.Timestamp(t))
+        lefts = []
+        t, end = when(start), when(end)
+        while t < end:
+            lefts.append(t)
+            t = t + step
+        rights = [t + step for t in lefts]
+        labels = [t.strftime('%Y-%m-%dT%H:%M:%SZ') for t in lefts]
+        return(lefts, rights, labels)
+    if gap <= 0:
+        raise ValueError('Range facet gap must be positive')
+    lefts = list(np.arange(float(start), float(end), gap))
+    rights = [t + gap for t in lefts]
+    labels = ['{0:g}'.format(t) for t in lefts]
+    return(lefts, rights, labels)
+
+
+def count_facets(root, facet_fields=('keyword',), facet_ranges=None,
+                 mincount=1):
+    """Count facet values in the documents of a PASTA search result
+
+    Counts are documents per value, as with Solr facets: a value repeated
+    within one document counts once.
+
+    Parameters
+    ----------
+    root : ElementTree object
+        An ElementTree object returned from a PASTA solr search that
+        requested the faceted fields
+    facet_fields : list, optional
+        Fields to count values of, by default ('keyword',)
+    facet_ranges : dict, optional
+        Range facets as {field: (start, end, gap)}, where gap is a number or
+        Solr date math ('+1YEAR', '+6MONTHS', ...) and start/end may be
+        'NOW', by default None
+    mincount : int, optional
+        Smallest count to include, by default 1
+
+    Returns
+    -------
+    dataframe
+        columns 'facet' (field name), 'type' ('field' or 'range'), 'value'
+        and 'count', as facetroot_to_df; field values are sorted by
+        descending count, range bins by their start
+    """
+    docs = list(root.iter('document'))
+    dfs = []
+    for f in facet_fields:
+        counts = pd.Series([t for d in docs for t in
+                            dict.fromkeys(el.text for el in d.iter(f)
+                                          if el.text)], dtype=object)
+        counts = counts.value_counts()
+        counts = counts[counts >= mincount]
+        counts = counts.iloc[np.lexsort((counts.index.to_numpy(),
+                                         -counts.to_numpy()))]
+        dfs.append(pd.DataFrame({'facet': f, 'type': 'field',
+            'value': counts.index.astype(str), 'count': counts.to_numpy()}))
+    for f, (start, end, gap) in (facet_ranges or {}).items():
+        lefts, rights, labels = _range_bins(start, end, gap)
+        texts = [d.findtext(f) for d in docs]
+        if isinstance(lefts[0] if lefts else 0, pd.Timestamp):
+            vals = pd.to_datetime(pd.Series(texts, dtype=object),
+                                  utc=True, errors='coerce')
+        else:
+            vals = pd.to_numeric(pd.Series(texts, dtype=object),
+                                 errors='coerce')
+        n = [int(((vals >= lo) & (vals < hi)).sum())
+             for lo, hi in zip(lefts, rights)]
+        keep = [c >= mincount for c in n]
+        dfs.append(pd.DataFrame({'facet': f, 'type': 'range',
+            'value': [l for l, k in zip(labels, keep) if k],
+            'count': [c for c, k in zip(n, keep) if k]}))
+    if not dfs:
+        return(pd.DataFrame({'facet': [], 'type': [], 'value': [],
+                             'count': []}))
+    df = pd.concat(dfs, ignore_index=True)
+    df['count'] = df['count'].astype(int)
+    return(df)
+
+
+def facet_pasta(query='scope:knb-lter-jrn', facet_fields=['keyword'],
+        facet_ranges=None, mincount=1, rows=10000, returnroot=False):
+    """Get facet counts (packages per value) for a PASTA search
+
+    PASTA's search service does not return Solr's facet counts, so this
+    requests only the faceted fields for each matching package and counts
+    them locally (see count_facets). The response holds one small record
+    per package rather than the full documents, but unlike a Solr facet
+    query its size still grows with the number of packages, and only the
+    first `rows` packages are counted.
+
+    Example:
+
+    df = search.facet_pasta(query='scope:knb-lter-jrn',
+                            facet_fields=['keyword', 'author'],
+                            facet_ranges={'pubdate': ('2000-01-01T00:00:00Z',
+                                                      'NOW', '+1YEAR')})
+
+    Parameters
+    ----------
+    query : str or list of strings, optional
+        A string or list of query terms (field:term), by default 'scope:knb-lter-jrn'
+    facet_fields : list, optional
+        Fields to count values of, by default ['keyword']
+    facet_ranges : dict, optional
+        Range facets as {field: (start, end, gap)}, by default None
+    mincount : int, optional
+        Smallest count to include, by default 1
+    rows : int, optional
+        Maximum number of packages to count, by default 10000
+    returnroot : bool, optional
+        Flag to return ElementTree root instead of dataframe, by default False
+
+    Returns
+    -------
+    dataframe or (dataframe, root)
+        Facet counts from count_facets, and optionally the ElementTree root
+    """
+    fields = list(dict.fromkeys(['packageid'] + list(facet_fields) +
+                                list(facet_ranges or {})))
+    response = rq.pasta_solr_search(query, ','.join(fields), 'packageid,asc',
+                                    rows)
+    root = rq.response_to_ET(response)
+    ndocs = len(list(root.iter('document')))
+    found = int(root.get('numFound', ndocs))
+    if found > ndocs:
+        print('Counted facets for {0} of {1} packages; raise rows to count '
+              'all of them'.format(ndocs, found))
+    df_out = count_facets(root, facet_fields, facet_ranges, mincount)
     if returnroot:
         return (df_out, root)
     else:
         return df_out
 
+
+def searchroot_to_coords(root, order='wsen'):
+    """Convert spatial coverages in a PASTA solr search result to a dataframe
+
+    Each 'coordinates' element of each document becomes a row keyed by
+    packageid, with its bounding box parsed into float columns. A point
+    (two values) becomes a zero-area box. Records that are not two or four
+    numbers are kept as rows of NaN.
+
+    Parameters
+    ----------
+    root : ElementTree object
+        An ElementTree object returned from a PASTA solr search that
+        requested the 'packageid' and 'coordinates' fields
+    order : str, optional
+        Order of the four values in a coordinates string, a permutation of
+        'wsen' (west south east north), by default 'wsen'
+
+    Returns
+    -------
+    dataframe
+        columns packageid, coverage (position within the package), west,
+        south, east and north
+    """
+    if sorted(order) != sorted('wsen'):
+        raise ValueError("order must be a permutation of 'wsen', got "
+                         "{0!r}".format(order))
+    pkgids, covs, texts = [], [], []
+    for doc in root.iter('document'):
+        pkgid = doc.findtext('packageid')
+        for i, c in enumerate(doc.iter('coordinates')):
+            pkgids.append(pkgid)
+            covs.append(i)
+            texts.append(c.text or '')
+    # Parse all coordinate strings into one (n, 4) float array, in 'wsen'
+    # column order whatever the input order
+    boxes = np.full((len(texts), 4), np.nan)
+    cols = ['wsen'.index(k) for k in order]
+    bad = 0
+    for i, t in enumerate(texts):
+        try:
+            v = np.array(t.replace(',', ' ').split(), dtype=float)
+        except ValueError:
+            # Non-numeric coordinates; leave the row as NaN
+            bad += 1
+            continue
+        if v.size == 2:
+            # A point, given as x y
+            boxes[i] = [v[0], v[1], v[0], v[1]]
+        elif v.size == 4:
+            boxes[i, cols] = v
+        else:
+            bad += 1
+    if bad:
+        print('{0} of {1} coordinate records could not be parsed'.format(
+            bad, len(texts)))
+    df = pd.DataFrame({'packageid': pkgids, 'coverage': covs,
+        'west': boxes[:, 0], 'south': boxes[:, 1],
+        'east': boxes[:, 2], 'north': boxes[:, 3]})
+    return(df)
+
+
+def bbox_intersects(coords, bbox):
+    """Vectorized test of which bounding boxes intersect a query box
+
+    Boxes are compared as plain longitude/latitude rectangles (boxes that
+    cross the antimeridian are not handled).
+
+    Parameters
+    ----------
+    coords : dataframe or array
+        Coordinates table from searchroot_to_coords, or an (n, 4) array of
+        west, south, east, north
+    bbox : sequence of float
+        Query box as (west, south, east, north)
+
+    Returns
+    -------
+    numpy bool array
+        True for each box that intersects (or touches) the query box; rows
+        with NaN coordinates are always False
+    """
+    if isinstance(coords, pd.DataFrame):
+        coords = coords[['west', 'south', 'east', 'north']].to_numpy()
+    coords = np.asarray(coords, dtype=float).reshape(-1, 4)
+    w, s, e, n = bbox
+    return((coords[:, 0] <= e) & (coords[:, 2] >= w) &
+           (coords[:, 1] <= n) & (coords[:, 3] >= s))
+
+
+def filter_bbox(coords, bbox):
+    """Rows of a coordinates table whose box intersects a query box
+
+    Parameters
+    ----------
+    coords : dataframe or array
+        Coordinates table from searchroot_to_coords, or an (n, 4) array of
+        west, south, east, north
+    bbox : sequence of float
+        Query box as (west, south, east, north)
+    """
+    mask = bbox_intersects(coords, bbox)
+    if isinstance(coords, pd.DataFrame):
+        return(coords[mask])
+    return(np.asarray(coords, dtype=float).reshape(-1, 4)[mask])
+
+
+def search_coords(query='scope:knb-lter-jrn', sortby='packageid,asc',
+        rows=500, order='wsen'):
+    """Search packages in PASTA and return their spatial coverages
+
+    Example:
+
+    coords = search.search_coords(query='scope:knb-lter-jrn', rows=1000)
+    inside = search.filter_bbox(coords, (-106.9, 32.4, -106.6, 32.7))
+
+    Parameters
+    ----------
+    query : str or list of strings, optional
+        A string or list of query terms (field:term), by default 'scope:knb-lter-jrn'
+    sortby : str, optional
+        List of  fields to sort result by, by default 'packageid,asc'
+    rows : int, optional
+        number of rows to return, by default 500
+    order : str, optional
+        Order of values in PASTA's coordinates strings, by default 'wsen'
+
+    Returns
+    -------
+    dataframe
+        Coordinates table from searchroot_to_coords
+    """
+    response = rq.pasta_solr_search(query, 'packageid,coordinates', sortby,
+        rows)
+    root = rq.response_to_ET(response)
+    return(searchroot_to_coords(root, order=order))
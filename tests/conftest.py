@@ -0,0 +1,110 @@
+"""Shared fixtures: package import and a local stand-in HTTP server."""
+import importlib.util
+import http.server
+import os
+import sys
+import threading
+
+import pytest
+
+# Import the repository as the 'pyEDIutils' package whatever the checkout
+# directory is called
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if 'pyEDIutils' not in sys.modules:
+    spec = importlib.util.spec_from_file_location(
+        'pyEDIutils', os.path.join(ROOT, '__init__.py'),
+        submodule_search_locations=[ROOT])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['pyEDIutils'] = module
+    spec.loader.exec_module(module)
+
+
+class StandIn(object):
+    """Local HTTP server whose responses are set per path by the test.
+
+    `routes` maps a path (without query string) to a function taking the
+    request handler and returning (status, headers dict, body bytes).
+    Every request is recorded in `requests` as (path, headers).
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        standin = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                with standin.lock:
+                    standin.requests.append((path, dict(self.headers)))
+                route = standin.routes.get(path)
+                if route is None:
+                    status, headers, body = 404, {}, b'not found'
+                else:
+                    status, headers, body = route(self)
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                     Handler)
+        self.httpd.daemon_threads = True
+        self.url = 'http://127.0.0.1:{0}'.format(self.httpd.server_address[1])
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    def serve_bytes(self, path, body, headers=None):
+        """Serve `body` at `path`, honoring 'Range: bytes=N-' requests"""
+        def route(handler):
+            rng = handler.headers.get('Range')
+            if rng is None:
+                return 200, dict(headers or {}), body
+            start = int(rng.split('=')[1].split('-')[0])
+            if start >= len(body):
+                return 416, {'Content-Range': 'bytes */{0}'.format(
+                    len(body))}, b''
+            out = dict(headers or {})
+            out['Content-Range'] = 'bytes {0}-{1}/{2}'.format(
+                start, len(body) - 1, len(body))
+            return 206, out, body[start:]
+        self.routes[path] = route
+
+    def count(self, path):
+        with self.lock:
+            return len([p for p, h in self.requests if p == path])
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def standin():
+    server = StandIn()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def throttle():
+    """The throttle module with fresh state and fast test settings"""
+    import pyEDIutils.throttle as th
+    saved = dict(th.settings)
+    th.reset()
+    th.configure(backoff_base=0.01, backoff_max=0.5, breaker_cooldown=0.3,
+                 breaker_max_wait=2.0, timeout=(2, 5))
+    yield th
+    th.settings.clear()
+    th.settings.update(saved)
+    th.reset()
+    th.disable_cache()
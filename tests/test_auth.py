@@ -0,0 +1,107 @@
+"""AuthSession token reuse against a stand-in PASTA server."""
+import base64
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import pyEDIutils.auth as auth
+import pyEDIutils.pasta_api_requests as rq
+
+DN = 'uid=test,o=EDI,dc=edirepository,dc=org'
+
+
+class FakePasta(object):
+    """Login and audit routes that issue and check auth-tokens."""
+
+    def __init__(self, standin, ttl=3600):
+        self.ttl = ttl
+        self.valid = set()
+        self.lock = threading.Lock()
+        self.serial = itertools.count()
+        standin.routes['/package/eml'] = self.login
+        standin.routes['/audit/count/'] = self.audit
+        standin.routes['/audit/report/'] = self.audit
+
+    def login(self, handler):
+        if not handler.headers.get('Authorization', '').startswith('Basic '):
+            return(401, {}, b'')
+        expiry_ms = int((time.time() + self.ttl) * 1000)
+        payload = '{0}*https://pasta.edirepository.org/authentication*{1}*' \
+            'authenticated{2}'.format(DN, expiry_ms, next(self.serial))
+        token = base64.b64encode(payload.encode()).decode() + '-sig'
+        with self.lock:
+            self.valid.add(token)
+        return(200, {'Set-Cookie': 'auth-token={0}; Path=/'.format(token)},
+               b'')
+
+    def audit(self, handler):
+        cookie = handler.headers.get('Cookie', '')
+        token = cookie.split('auth-token=', 1)[-1].split(';')[0]
+        with self.lock:
+            ok = token in self.valid
+        if not ok:
+            return(401, {}, b'')
+        return(200, {'Content-Type': 'text/plain'}, b'3')
+
+    def revoke(self):
+        with self.lock:
+            self.valid.clear()
+
+
+@pytest.fixture
+def pasta(standin, throttle):
+    auth._sessions.clear()
+    yield FakePasta(standin), standin
+    auth._sessions.clear()
+
+
+def count(standin, pw='pw'):
+    return(rq.aud_count_dpm('readDataPackage', None, None, 'knb-lter-jrn',
+        None, None, 10, DN, pw, base_url=standin.url + '/audit/',
+        login_url=standin.url + '/package/eml'))
+
+
+def test_concurrent_calls_share_one_login(pasta):
+    fake, standin = pasta
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        responses = list(pool.map(lambda i: count(standin), range(16)))
+    assert [r.status_code for r in responses] == [200] * 16
+    assert standin.count('/package/eml') == 1
+    assert standin.count('/audit/count/') == 16
+
+
+def test_token_refreshed_before_expiry(pasta):
+    fake, standin = pasta
+    fake.ttl = 2.0
+    session = auth.get_session(DN, 'pw', refresh_margin=1.0,
+                               login_url=standin.url + '/package/eml')
+    assert count(standin).status_code == 200
+    assert count(standin).status_code == 200
+    assert session.logins == 1
+    # Within refresh_margin of expiry the token is renewed before use
+    time.sleep(1.2)
+    assert count(standin).status_code == 200
+    assert session.logins == 2
+    assert standin.count('/audit/count/') == 3
+
+
+def test_relogin_on_401(pasta):
+    fake, standin = pasta
+    assert count(standin).status_code == 200
+    fake.revoke()
+    response = count(standin)
+    assert response.status_code == 200
+    assert standin.count('/package/eml') == 2
+    # The rejected call is retried once with the new token
+    assert standin.count('/audit/count/') == 3
+
+
+def test_sessions_are_per_server(pasta):
+    fake, standin = pasta
+    default = auth.get_session(DN, 'pw')
+    local = auth.get_session(DN, 'pw', login_url=standin.url + '/package/eml')
+    assert default is not local
+    assert local.login_url.startswith(standin.url)
@@ -0,0 +1,85 @@
+"""Archiving change records with a recorded checksum."""
+import gzip
+import hashlib
+import os
+
+import pytest
+
+import pyEDIutils.changes as changes
+import pyEDIutils.checksums as cs
+import pyEDIutils.pasta_api_requests as rq
+
+XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<dataPackageChanges>
+<dataPackage><packageId>knb-lter-jrn.1.1</packageId><scope>knb-lter-jrn</scope>
+<identifier>1</identifier><revision>1</revision>
+<serviceMethod>createDataPackage</serviceMethod>
+<date>2025-01-02T10:00:00.000</date></dataPackage>
+<dataPackage><packageId>knb-lter-jrn.2.1</packageId><scope>knb-lter-jrn</scope>
+<identifier>2</identifier><revision>1</revision>
+<serviceMethod>updateDataPackage</serviceMethod>
+<date>2025-01-03T11:00:00.000</date></dataPackage>
+</dataPackageChanges>
+"""
+
+
+@pytest.fixture
+def pasta(standin, throttle, monkeypatch):
+    def recent_changes(scope, fromdt, todt=None, stream=False):
+        return(throttle.get(standin.url + '/changes', stream=stream))
+    monkeypatch.setattr(rq, 'recent_changes', recent_changes)
+    return(standin)
+
+
+def sidecar(path):
+    with open(path + '.sha256') as f:
+        return(f.read().split())
+
+
+def test_gzip_response_is_archived_as_received(pasta, tmp_path):
+    body = gzip.compress(XML)
+    pasta.routes['/changes'] = lambda h: (200, {'Content-Encoding': 'gzip'},
+                                          body)
+    path, checksum = changes.archive_requested_changes(str(tmp_path),
+        '2025-01-01', '2025-01-31')
+    with open(path, 'rb') as f:
+        assert f.read() == body
+    assert checksum == hashlib.sha256(body).hexdigest()
+    assert sidecar(path) == [checksum, os.path.basename(path)]
+    df = changes.load_archived_changes(str(tmp_path))
+    assert df.pkgid.tolist() == [1, 2]
+
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_identity_response_checksum_matches_file(pasta, tmp_path, compress):
+    pasta.routes['/changes'] = lambda h: (200, {}, XML)
+    path, checksum = changes.archive_requested_changes(str(tmp_path),
+        '2025-01-01', '2025-01-31', compress=compress)
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert checksum == hashlib.sha256(data).hexdigest()
+    assert (gzip.decompress(data) if compress else data) == XML
+    assert changes.verify_archive(path)
+    assert len(changes.load_archived_changes(str(tmp_path))) == 2
+
+
+def test_modified_archive_fails_verification(pasta, tmp_path):
+    pasta.routes['/changes'] = lambda h: (200, {}, XML)
+    path, checksum = changes.archive_requested_changes(str(tmp_path),
+        '2025-01-01', '2025-01-31', compress=False)
+    with open(path, 'ab') as f:
+        f.write(b'<!-- edited -->\n')
+    with pytest.raises(cs.ChecksumError):
+        changes.load_archived_changes(str(tmp_path))
+    assert len(changes.load_archived_changes(str(tmp_path),
+                                             verify=False)) == 2
+
+
+def test_truncated_gzip_response_leaves_no_archive(pasta, tmp_path):
+    body = gzip.compress(XML)[:-20]
+    pasta.routes['/changes'] = lambda h: (200, {'Content-Encoding': 'gzip'},
+                                          body)
+    with pytest.raises(IOError):
+        changes.archive_requested_changes(str(tmp_path), '2025-01-01',
+                                          '2025-01-31')
+    assert os.listdir(str(tmp_path)) == []
@@ -0,0 +1,133 @@
+"""Entity downloads against a stand-in PASTA server."""
+import hashlib
+import os
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+import pyEDIutils.checksums as cs
+import pyEDIutils.download as dl
+import pyEDIutils.pasta_api_requests as rq
+
+BODY = b''.join(b'%d,%d\n' % (i, i * i) for i in range(2000))
+SHA1 = hashlib.sha1(BODY).hexdigest()
+DATA = '/package/data/eml/knb-lter-jrn/1/1/abc'
+CHECKSUM = '/package/data/checksum/eml/knb-lter-jrn/1/1/abc'
+
+
+@pytest.fixture
+def pasta(standin, throttle, monkeypatch):
+    monkeypatch.setattr(rq, 'PACKAGE_URL', standin.url + '/package/')
+    standin.serve_bytes(DATA, BODY)
+    standin.routes[CHECKSUM] = lambda h: (200, {}, SHA1.encode())
+    return(standin)
+
+
+def ranges(standin):
+    return([h.get('Range') for p, h in standin.requests if p == DATA])
+
+
+def download(tmp_path, **kwargs):
+    return(dl.download_entity('knb-lter-jrn', 1, 1, 'abc',
+                              str(tmp_path / 'out.csv'), **kwargs))
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return(f.read())
+
+
+def test_full_download_is_verified(pasta, tmp_path):
+    out = download(tmp_path)
+    assert read(out['path']) == BODY
+    assert out == {'path': str(tmp_path / 'out.csv'), 'bytes': len(BODY),
+                   'resumed_from': 0, 'sha1': SHA1}
+    assert ranges(pasta) == [None]
+    assert not os.path.exists(out['path'] + '.part')
+
+
+def test_partial_download_resumes_with_range(pasta, tmp_path):
+    with open(str(tmp_path / 'out.csv.part'), 'wb') as f:
+        f.write(BODY[:1000])
+    out = download(tmp_path)
+    assert read(out['path']) == BODY
+    assert out['resumed_from'] == 1000
+    assert out['bytes'] == len(BODY) - 1000
+    assert ranges(pasta) == ['bytes=1000-']
+
+
+def test_ignored_range_restarts(pasta, tmp_path):
+    pasta.routes[DATA] = lambda h: (200, {}, BODY)
+    with open(str(tmp_path / 'out.csv.part'), 'wb') as f:
+        f.write(BODY[:1000])
+    out = download(tmp_path)
+    assert read(out['path']) == BODY
+    assert out['resumed_from'] == 0
+    assert ranges(pasta) == ['bytes=1000-', None]
+
+
+@pytest.mark.parametrize('verify', [True, False])
+def test_complete_part_is_kept_on_416(pasta, tmp_path, verify):
+    with open(str(tmp_path / 'out.csv.part'), 'wb') as f:
+        f.write(BODY)
+    out = download(tmp_path, verify=verify)
+    assert read(out['path']) == BODY
+    assert out['bytes'] == 0 and out['sha1'] == SHA1
+    # No second, full download
+    assert ranges(pasta) == ['bytes={0}-'.format(len(BODY))]
+
+
+def test_corrupt_complete_part_is_downloaded_again(pasta, tmp_path):
+    with open(str(tmp_path / 'out.csv.part'), 'wb') as f:
+        f.write(b'x' * len(BODY))
+    out = download(tmp_path)
+    assert read(out['path']) == BODY
+    assert ranges(pasta) == ['bytes={0}-'.format(len(BODY)), None]
+
+
+def test_checksum_mismatch_removes_part(pasta, tmp_path):
+    pasta.routes[CHECKSUM] = lambda h: (200, {}, b'0' * 40)
+    with pytest.raises(cs.ChecksumError):
+        download(tmp_path)
+    assert os.listdir(str(tmp_path)) == []
+    # The alias in download is the shared exception
+    assert dl.ChecksumError is cs.ChecksumError
+
+
+def test_read_entity_chunks_verifies_sha1(pasta):
+    chunks = list(dl.read_entity_chunks('knb-lter-jrn', 1, 1, 'abc',
+        chunksize=500, header=None))
+    assert len(chunks) == 4
+    assert pd.concat(chunks)[1].iloc[-1] == 1999 * 1999
+    pasta.routes[CHECKSUM] = lambda h: (200, {}, b'0' * 40)
+    with pytest.raises(cs.ChecksumError):
+        for chunk in dl.read_entity_chunks('knb-lter-jrn', 1, 1, 'abc',
+                                           chunksize=500, header=None):
+            pass
+
+
+def test_bandwidth_limiter_caps_combined_rate():
+    limiter = dl.BandwidthLimiter(10000)
+    start = time.monotonic()
+    threads = [threading.Thread(target=limiter.consume, args=(2000,))
+               for i in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # 6000 bytes at 10000 bytes/s
+    assert time.monotonic() - start >= 0.55
+
+
+def test_download_entities_keeps_files_in_outdir(pasta, tmp_path):
+    entities = pd.DataFrame({'scope': ['knb-lter-jrn'] * 3,
+        'identifier': [1] * 3, 'revision': [1] * 3, 'entityid': ['abc'] * 3,
+        'filename': ['../../evil.csv', '/tmp/abs.csv', '..']})
+    df = dl.download_entities(entities, str(tmp_path / 'out'),
+                              max_workers=1)
+    pkgdir = tmp_path / 'out' / 'knb-lter-jrn.1.1'
+    assert df.error.isna().all()
+    assert sorted(os.listdir(str(pkgdir))) == ['abc', 'abs.csv', 'evil.csv']
+    assert sorted(os.listdir(str(tmp_path))) == ['out']
@@ -0,0 +1,137 @@
+"""Job manifest scheduling, checkpoints and outputs."""
+import json
+import os
+import threading
+
+import pytest
+
+import pyEDIutils.jobs as jobs
+
+calls = []
+
+
+def record(name, value=None, upstream=None):
+    calls.append(name)
+    return((upstream or []) + [value if value is not None else name])
+
+
+def fail(**kwargs):
+    raise RuntimeError('step failed')
+
+
+@pytest.fixture(autouse=True)
+def step_functions(monkeypatch):
+    """Test step functions, callable from manifests as 'jobs.<name>'"""
+    del calls[:]
+    monkeypatch.setattr(jobs, 'record', record, raising=False)
+    monkeypatch.setattr(jobs, 'fail', fail, raising=False)
+
+
+def manifest(workdir):
+    return({'workdir': str(workdir), 'steps': {
+        'agents': {'call': 'useragents.classify',
+                   'args': {'agents': ['curl/8.0', 'Mozilla/5.0'],
+                            'cache_path': None},
+                   'output': 'agents.json', 'depends': []}}})
+
+
+def chain(workdir, a_value='a'):
+    return({'workdir': str(workdir), 'steps': {
+        'c': {'call': 'jobs.record',
+              'args': {'name': 'c', 'upstream': '@b'}},
+        'b': {'call': 'jobs.record',
+              'args': {'name': 'b', 'upstream': '@a'}},
+        'a': {'call': 'jobs.record', 'args': {'name': 'a',
+                                              'value': a_value}},
+        'other': {'call': 'jobs.record', 'args': {'name': 'other'}}}})
+
+
+def test_checkpointed_step_restores_missing_output(tmp_path):
+    path = tmp_path / 'agents.json'
+    outputs, timing = jobs.run_manifest(manifest(tmp_path), workers=1)
+    assert timing.loc['agents', 'status'] == 'done'
+    assert json.loads(path.read_text()) == ['script', 'browser']
+    os.remove(path)
+    outputs, timing = jobs.run_manifest(manifest(tmp_path), workers=1)
+    assert timing.loc['agents', 'status'] == 'checkpoint'
+    assert json.loads(path.read_text()) == ['script', 'browser']
+
+
+def test_steps_run_after_their_dependencies(tmp_path):
+    outputs, timing = jobs.run_manifest(chain(tmp_path), workers=4)
+    assert calls.index('a') < calls.index('b') < calls.index('c')
+    assert outputs['c'] == ['a', 'b', 'c']
+    assert (timing.status == 'done').all()
+
+
+def test_independent_steps_run_in_parallel(tmp_path, monkeypatch):
+    # Each step waits for the other, which only works if both run at once
+    barrier = threading.Barrier(2, timeout=5)
+
+    def meet(name):
+        barrier.wait()
+        return(name)
+    monkeypatch.setattr(jobs, 'meet', meet, raising=False)
+    steps = {n: {'call': 'jobs.meet', 'args': {'name': n}}
+             for n in ('x', 'y')}
+    outputs, timing = jobs.run_manifest(
+        {'workdir': str(tmp_path), 'steps': steps}, workers=2)
+    assert outputs == {'x': 'x', 'y': 'y'}
+
+
+def test_failure_skips_downstream_steps(tmp_path, capsys):
+    m = chain(tmp_path)
+    m['steps']['a'] = {'call': 'jobs.fail', 'args': {}}
+    with pytest.raises(RuntimeError, match='step failed'):
+        jobs.run_manifest(m, workers=1)
+    assert 'b' not in calls and 'c' not in calls
+    # Status column of the printed timing table
+    status = dict(l.split()[:2] for l in capsys.readouterr().out.splitlines()
+                  if l.split()[:1] in (['a'], ['b'], ['c']))
+    assert status == {'a': 'failed', 'b': 'skipped', 'c': 'skipped'}
+    assert not os.path.exists(tmp_path / '.checkpoints' / 'b.pkl')
+
+
+def test_upstream_change_invalidates_downstream_checkpoints(tmp_path):
+    jobs.run_manifest(chain(tmp_path), workers=2)
+    del calls[:]
+    outputs, timing = jobs.run_manifest(chain(tmp_path, a_value='A'),
+                                        workers=2)
+    assert sorted(calls) == ['a', 'b', 'c']
+    assert timing.loc['other', 'status'] == 'checkpoint'
+    assert outputs['c'] == ['A', 'b', 'c']
+
+
+def test_dict_manifest_is_normalized(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    m = {'workdir': 'run', 'steps': {
+        'a': {'call': 'jobs.record', 'args': {'name': 'a'}},
+        'b': {'call': 'jobs.record', 'args': {'name': 'b', 'upstream': '@a'},
+              'output': 'b.json'}}}
+    outputs, timing = jobs.run_manifest(m, workers=1)
+    assert json.loads((tmp_path / 'run' / 'b.json').read_text()) == ['a', 'b']
+    # The caller's manifest is left as it was
+    assert 'depends' not in m['steps']['a']
+
+
+def test_caller_cache_is_kept(tmp_path, throttle):
+    throttle.enable_cache()
+    jobs.run_manifest(chain(tmp_path), workers=1)
+    assert throttle.cache_enabled()
+    throttle.disable_cache()
+    jobs.run_manifest(chain(tmp_path), workers=1)
+    assert not throttle.cache_enabled()
+
+
+def test_main_runs_manifest_file(tmp_path):
+    m = chain('out')
+    m['steps']['c']['output'] = 'c.json'
+    path = tmp_path / 'manifest.json'
+    path.write_text(json.dumps(m))
+    jobs.main(['run', str(path), '--workers', '2'])
+    # workdir is relative to the manifest file
+    out = tmp_path / 'out' / 'c.json'
+    assert json.loads(out.read_text()) == ['a', 'b', 'c']
+    del calls[:]
+    jobs.main(['run', str(path), '--force'])
+    assert sorted(calls) == ['a', 'b', 'c', 'other']
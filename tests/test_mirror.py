@@ -0,0 +1,103 @@
+import hashlib
+import os
+
+import pandas as pd
+import pytest
+import requests
+
+import pyEDIutils.mirror as mi
+import pyEDIutils.pasta_api_requests as rq
+import pyEDIutils.search as search
+
+DATA = {'e1': b'a,b\n1,2\n', 'e2': b'a,b\n3,4\n'}
+
+
+def mock_pasta(monkeypatch, standin, throttle, pkgids):
+    calls = {'names': 0, 'checksum': 0}
+    for e, body in DATA.items():
+        standin.routes['/' + e] = lambda h, body=body: (200, {}, body)
+
+    def names(scope, identifier, revision):
+        calls['names'] += 1
+        return pd.DataFrame({'entityid': ['e1', 'e2'],
+                             'entityname': ['one', 'two']})
+
+    def checksum(scope, identifier, revision, entityid):
+        calls['checksum'] += 1
+        return hashlib.sha1(DATA[entityid]).hexdigest()
+
+    def data(scope, identifier, revision, entityid, offset=0):
+        return throttle.get(standin.url + '/' + entityid, stream=True)
+
+    monkeypatch.setattr(search, 'search_pasta',
+        lambda **kw: pd.DataFrame({'packageid': list(pkgids)}))
+    monkeypatch.setattr(rq, 'pkg_entity_names', names)
+    monkeypatch.setattr(rq, 'pkg_entity_checksum', checksum)
+    monkeypatch.setattr(rq, 'pkg_entity_data', data)
+    return calls
+
+
+def test_sync_downloads_links_and_skips(monkeypatch, standin, throttle,
+                                        tmp_path):
+    pkgids = ['s.1.1', 's.2.1']
+    calls = mock_pasta(monkeypatch, standin, throttle, pkgids)
+    df = mi.sync_mirror(str(tmp_path))
+    assert sorted(df.action) == ['downloaded', 'downloaded', 'linked',
+                                 'linked']
+    assert calls == {'names': 2, 'checksum': 4}
+    # Nothing changed: no metadata requests and no downloads
+    n_data = standin.count('/e1') + standin.count('/e2')
+    df = mi.sync_mirror(str(tmp_path))
+    assert set(df.action) == {'unchanged'}
+    assert calls == {'names': 2, 'checksum': 4}
+    assert standin.count('/e1') + standin.count('/e2') == n_data
+    # A new revision is listed on its own and hardlinked
+    pkgids.append('s.1.2')
+    df = mi.sync_mirror(str(tmp_path))
+    assert calls == {'names': 3, 'checksum': 6}
+    assert sorted(df.action) == ['linked', 'linked'] + ['unchanged'] * 4
+    assert os.stat(os.path.join(str(tmp_path), 's', '1', '2',
+                                'e1')).st_nlink > 1
+
+
+def test_unlistable_package_does_not_stop_sync(monkeypatch, standin,
+                                               throttle, tmp_path):
+    pkgids = ['s.1.1', 's.2.1']
+    calls = mock_pasta(monkeypatch, standin, throttle, pkgids)
+    checksum = rq.pkg_entity_checksum
+
+    def restricted(scope, identifier, revision, entityid):
+        if identifier == '2':
+            raise requests.HTTPError('401 Client Error: Unauthorized')
+        return checksum(scope, identifier, revision, entityid)
+    monkeypatch.setattr(rq, 'pkg_entity_checksum', restricted)
+    df = mi.sync_mirror(str(tmp_path))
+    failed = df[df.action == 'failed']
+    assert failed[['scope', 'identifier', 'revision']].values.tolist() == \
+        [['s', '2', '1']]
+    assert failed.entityid.isna().all()
+    assert sorted(df.action[df.action != 'failed']) == ['downloaded',
+                                                        'downloaded']
+    # The listing that worked is saved; the failed one is retried
+    manifest = mi.load_mirror_manifest(str(tmp_path))
+    assert sorted(manifest['packages']) == ['s.1.1']
+    monkeypatch.setattr(rq, 'pkg_entity_checksum', checksum)
+    df = mi.sync_mirror(str(tmp_path))
+    assert calls['names'] == 3
+    assert sorted(df.action) == ['linked', 'linked', 'unchanged',
+                                 'unchanged']
+
+
+def test_manifest_saved_when_sync_fails(monkeypatch, standin, throttle,
+                                        tmp_path):
+    pkgids = ['s.1.1']
+    mock_pasta(monkeypatch, standin, throttle, pkgids)
+
+    def broken(*args, **kwargs):
+        raise RuntimeError('disk full')
+    monkeypatch.setattr(mi, '_link_or_copy', broken)
+    monkeypatch.setattr(mi.dl, 'BandwidthLimiter', broken)
+    with pytest.raises(RuntimeError):
+        mi.sync_mirror(str(tmp_path), max_bps=1000)
+    manifest = mi.load_mirror_manifest(str(tmp_path))
+    assert sorted(manifest['packages']) == ['s.1.1']
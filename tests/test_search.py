@@ -0,0 +1,201 @@
+"""Parsing and local counting of search results."""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import pyEDIutils.pasta_api_requests as rq
+import pyEDIutils.search as search
+import pyEDIutils.xmlparse as xp
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def load(name):
+    with open(os.path.join(DATA, name), 'rb') as f:
+        return(xp.fromstring(f.read()))
+
+
+@pytest.mark.parametrize('backend', ['lxml', 'stdlib'])
+def test_facetroot_to_df_reads_solr_facet_counts(backend):
+    saved = xp.get_backend()
+    try:
+        xp.set_backend(backend)
+    except ImportError:
+        pytest.skip('lxml is not installed')
+    try:
+        df = search.facetroot_to_df(load('solr_facets.xml'))
+    finally:
+        xp.set_backend(saved)
+    assert list(df.columns) == ['facet', 'type', 'value', 'count']
+    assert len(df) == 8
+    kw = df[df.facet == 'keyword'].set_index('value')['count']
+    assert kw.to_dict() == {'vegetation': 118, 'net primary production': 64,
+                            'precipitation': 41}
+    assert (df[df.facet == 'author'].type == 'field').all()
+    years = df[df.facet == 'pubdate']
+    assert (years.type == 'range').all()
+    assert years['count'].tolist() == [22, 31, 19]
+    # The echoed request parameters are not mistaken for facet values
+    assert 'rows' not in df.value.tolist()
+
+
+def test_facetroot_to_df_without_facets_raises():
+    with pytest.raises(ValueError, match='facet_counts'):
+        search.facetroot_to_df(load('pasta_resultset.xml'))
+
+
+def test_count_facets_counts_documents_per_value():
+    df = search.count_facets(load('search.xml'), ['keyword', 'author'],
+        {'pubdate': ('2023-01-01T00:00:00Z', '2026-01-01T00:00:00Z',
+                     '+1YEAR')})
+    kw = df[df.facet == 'keyword'].set_index('value')['count']
+    # 'vegetation' appears twice in one document but counts once
+    assert kw.to_dict() == {'net primary production': 1, 'precipitation': 1,
+                            'vegetation': 1}
+    au = df[df.facet == 'author']
+    assert au.value.tolist() == ['Peters, Debra', 'Bestelmeyer, Brandon']
+    assert au['count'].tolist() == [2, 1]
+    years = df[df.facet == 'pubdate']
+    assert (years.type == 'range').all()
+    # The empty 2023 bin is dropped by mincount=1
+    assert years.value.tolist() == ['2024-01-01T00:00:00Z',
+                                    '2025-01-01T00:00:00Z']
+    assert years['count'].tolist() == [1, 1]
+
+
+def test_count_facets_numeric_ranges_and_mincount():
+    df = search.count_facets(load('search.xml'), ['author'],
+        {'pubdate': (2020, 2026, 2)}, mincount=0)
+    assert df[df.facet == 'pubdate'][['value', 'count']].values.tolist() == \
+        [['2020', 0], ['2022', 0], ['2024', 2]]
+    df = search.count_facets(load('search.xml'), ['author'], mincount=2)
+    assert df.value.tolist() == ['Peters, Debra']
+    with pytest.raises(ValueError, match='gap'):
+        search.count_facets(load('search.xml'), [],
+                            {'pubdate': ('2020-01-01', 'NOW', '+1FORTNIGHT')})
+
+
+def test_facet_pasta_requests_only_faceted_fields(monkeypatch, capsys):
+    sent = {}
+
+    def solr_search(fqs, fls, sort, rows, **kwargs):
+        sent.update(fl=fls, rows=rows, kwargs=kwargs)
+        return(None)
+    monkeypatch.setattr(rq, 'pasta_solr_search', solr_search)
+    monkeypatch.setattr(rq, 'response_to_ET',
+                        lambda response: load('search.xml'))
+    df = search.facet_pasta(facet_fields=['keyword', 'author'],
+        facet_ranges={'pubdate': ('2024-01-01T00:00:00Z',
+                                  '2026-01-01T00:00:00Z', '+1YEAR')},
+        rows=2)
+    assert sent == {'fl': 'packageid,keyword,author,pubdate', 'rows': 2,
+                    'kwargs': {}}
+    assert set(df.facet) == {'keyword', 'author', 'pubdate'}
+    assert 'Counted facets' not in capsys.readouterr().out
+
+
+def test_exploded_tables_and_index_agree():
+    df, tables = search.searchroot_to_df(load('search.xml'),
+        ['packageid', 'keyword', 'author'], explode=True)
+    kw = tables['keywords']
+    assert list(kw.columns) == ['packageid', 'row', 'keyword']
+    # 'vegetation' is repeated in the first document but kept once
+    assert kw.keyword.astype(str).tolist() == [
+        'vegetation', 'net primary production', 'precipitation']
+    assert kw.row.tolist() == [0, 0, 1]
+    assert kw.packageid.astype(str).tolist()[2] == 'knb-lter-jrn.210002002.1'
+    index = tables['index']['keyword']
+    counts = kw.keyword.value_counts()
+    assert {t: len(r) for t, r in index.items()} == \
+        {t: int(n) for t, n in counts.items()}
+    assert tables['authors'].author.value_counts()['Peters, Debra'] == 2
+    # The joined column keeps the document's terms as given
+    assert df.keywords[0] == 'vegetation;net primary production;vegetation'
+
+
+def test_search_terms():
+    df, tables = search.searchroot_to_df(load('search.xml'),
+        ['packageid', 'keyword', 'author'], explode=True)
+    hits = search.search_terms(df, tables, 'author', 'Peters, Debra')
+    assert hits.packageid.tolist() == ['knb-lter-jrn.210001001.2',
+                                       'knb-lter-jrn.210002002.1']
+    assert search.search_terms(df, tables, 'keyword', 'soil').empty
+    df, tables = search.searchroot_to_df(load('search.xml'),
+        ['packageid', 'keyword'], explode=True)
+    with pytest.raises(ValueError, match='author'):
+        search.search_terms(df, tables, 'author', 'Peters, Debra')
+
+
+def test_searchroot_to_coords_keeps_bad_records_as_nan():
+    root = xp.fromstring(
+        b'<resultset><document><packageid>knb-lter-jrn.1.1</packageid>'
+        b'<spatialCoverage><coordinates>-106.9 32.4 -106.6 32.7</coordinates>'
+        b'<coordinates>-106.8 32.5</coordinates>'
+        b'<coordinates>see metadata</coordinates>'
+        b'<coordinates/>'
+        b'<coordinates>1 2 3</coordinates></spatialCoverage></document>'
+        b'<document><packageid>knb-lter-jrn.2.1</packageid>'
+        b'<spatialCoverage><coordinates>-107,32,-106,33</coordinates>'
+        b'</spatialCoverage></document></resultset>')
+    df = search.searchroot_to_coords(root)
+    assert len(df) == 6
+    assert df.iloc[0][['west', 'south', 'east', 'north']].tolist() == \
+        [-106.9, 32.4, -106.6, 32.7]
+    assert df.iloc[1][['west', 'east']].tolist() == [-106.8, -106.8]
+    assert df.iloc[2:5][['west', 'south', 'east', 'north']].isna().all().all()
+    assert df.iloc[5].packageid == 'knb-lter-jrn.2.1'
+    assert df.iloc[5].north == 33.0
+
+
+def test_searchroot_to_coords_order():
+    root = xp.fromstring(
+        b'<resultset><document><packageid>p.1.1</packageid>'
+        b'<coordinates>32.4 -106.9 32.7 -106.6</coordinates></document>'
+        b'<coordinates>1 2 3 4</coordinates></resultset>')
+    df = search.searchroot_to_coords(root, order='swne')
+    # Coordinates outside a document are not read as a document
+    assert len(df) == 1
+    assert df.iloc[0][['west', 'south', 'east', 'north']].tolist() == \
+        [-106.9, 32.4, -106.6, 32.7]
+    for order in ('xyz', 'wwen', 'wsenw'):
+        with pytest.raises(ValueError, match='permutation'):
+            search.searchroot_to_coords(root, order=order)
+
+
+COORDS = pd.DataFrame({'packageid': ['a', 'b', 'c', 'd', 'e'],
+    'west': [0.0, 2.0, 5.0, np.nan, -3.0],
+    'south': [0.0, 2.0, 5.0, np.nan, 1.0],
+    'east': [1.0, 3.0, 6.0, np.nan, -2.0],
+    'north': [1.0, 3.0, 6.0, np.nan, 1.0]})
+
+
+def test_bbox_intersects_edges_and_nan():
+    # Query box (1, 1)-(2, 2) touches 'a' at a corner and 'b' at a corner
+    mask = search.bbox_intersects(COORDS, (1, 1, 2, 2))
+    assert mask.tolist() == [True, True, False, False, False]
+    # A point box on an edge counts; NaN rows never match
+    mask = search.bbox_intersects(COORDS, (-2, 1, -2, 1))
+    assert mask.tolist() == [False, False, False, False, True]
+    assert not search.bbox_intersects(COORDS, (-180, -90, 180, 90))[3]
+
+
+def test_bbox_intersects_accepts_arrays():
+    arr = COORDS[['west', 'south', 'east', 'north']].to_numpy()
+    box = (0.5, 0.5, 5.5, 5.5)
+    expected = search.bbox_intersects(COORDS, box).tolist()
+    assert expected == [True, True, True, False, False]
+    assert search.bbox_intersects(arr, box).tolist() == expected
+    assert search.bbox_intersects(arr.tolist(), box).tolist() == expected
+    assert search.bbox_intersects([0, 0, 1, 1], box).tolist() == [True]
+
+
+def test_filter_bbox():
+    box = (0.5, 0.5, 5.5, 5.5)
+    assert search.filter_bbox(COORDS, box).packageid.tolist() == \
+        ['a', 'b', 'c']
+    arr = COORDS[['west', 'south', 'east', 'north']].to_numpy()
+    out = search.filter_bbox(arr, box)
+    assert out.shape == (3, 4)
+    assert out[:, 0].tolist() == [0.0, 2.0, 5.0]
@@ -0,0 +1,139 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+
+def test_retries_until_success(standin, throttle):
+    calls = []
+    def flaky(handler):
+        calls.append(1)
+        if len(calls) < 3:
+            return 502, {}, b'bad gateway'
+        return 200, {}, b'ok'
+    standin.routes['/flaky'] = flaky
+    r = throttle.get(standin.url + '/flaky')
+    assert r.status_code == 200
+    st = throttle.stats()[standin.url[7:]]
+    assert st['retries'] == 2
+    assert st['failures'] == 2
+    assert st['in_flight'] == 0
+
+
+def test_retry_after_is_honored(standin, throttle):
+    throttle.configure(backoff_max=5)
+    calls = []
+    def slow_down(handler):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            return 429, {'Retry-After': '1'}, b'slow down'
+        return 200, {}, b'ok'
+    standin.routes['/limited'] = slow_down
+    r = throttle.get(standin.url + '/limited')
+    assert r.status_code == 200
+    assert calls[1] - calls[0] >= 0.9
+
+
+def test_throttling_does_not_trip_breaker(standin, throttle):
+    throttle.configure(max_retries=6, breaker_threshold=3)
+    calls = []
+    def limited(handler):
+        calls.append(1)
+        if len(calls) <= 5:
+            return 429, {'Retry-After': '0'}, b'slow down'
+        return 200, {}, b'ok'
+    standin.routes['/limited'] = limited
+    assert throttle.get(standin.url + '/limited').status_code == 200
+    st = throttle.stats()[standin.url[7:]]
+    assert st['throttled'] == 5
+    assert st['breaker_trips'] == 0
+    assert st['breaker'] == 'closed'
+
+
+def test_burst_of_throttles_halves_limit_once(standin, throttle):
+    throttle.configure(max_retries=0, start_concurrency=8,
+                       decrease_window=60)
+    standin.routes['/limited'] = lambda h: (429, {}, b'slow down')
+    for _ in range(4):
+        throttle.get(standin.url + '/limited')
+    assert throttle.stats()[standin.url[7:]]['concurrency_limit'] == 4
+
+
+def test_breaker_opens_and_callers_wait_out_cooldown(standin, throttle):
+    throttle.configure(max_retries=0, breaker_threshold=2)
+    state = {'down': True}
+    def outage(handler):
+        return (500, {}, b'down') if state['down'] else (200, {}, b'ok')
+    standin.routes['/svc'] = outage
+    for _ in range(2):
+        assert throttle.get(standin.url + '/svc').status_code == 500
+    st = throttle.stats()[standin.url[7:]]
+    assert st['breaker'] == 'open'
+    assert st['breaker_trips'] == 1
+    # The next caller waits for the cooldown instead of raising
+    state['down'] = False
+    start = time.monotonic()
+    assert throttle.get(standin.url + '/svc').status_code == 200
+    assert time.monotonic() - start >= 0.2
+    assert throttle.stats()[standin.url[7:]]['breaker'] == 'closed'
+
+
+def test_breaker_raises_when_wait_would_be_too_long(standin, throttle):
+    throttle.configure(max_retries=0, breaker_threshold=1,
+                       breaker_cooldown=30, breaker_max_wait=0.1)
+    standin.routes['/svc'] = lambda h: (500, {}, b'down')
+    throttle.get(standin.url + '/svc')
+    with pytest.raises(throttle.CircuitOpenError):
+        throttle.get(standin.url + '/svc')
+
+
+def test_slot_released_on_non_retried_error(standin, throttle):
+    throttle.configure(start_concurrency=1, max_concurrency=1)
+    standin.routes['/loop'] = lambda h: (302, {'Location': '/loop'}, b'')
+    standin.routes['/ok'] = lambda h: (200, {}, b'ok')
+    session = requests.Session()
+    session.max_redirects = 3
+    for _ in range(4):
+        with pytest.raises(requests.exceptions.TooManyRedirects):
+            throttle.get(standin.url + '/loop', session=session)
+    assert throttle.stats()[standin.url[7:]]['in_flight'] == 0
+    # The host still accepts requests
+    result = {}
+    t = threading.Thread(target=lambda: result.update(
+        r=throttle.get(standin.url + '/ok')))
+    t.start()
+    t.join(5)
+    assert result['r'].status_code == 200
+
+
+def test_identical_requests_in_flight_are_merged(standin, throttle):
+    def slow(handler):
+        time.sleep(0.3)
+        return 200, {}, b'shared'
+    standin.routes['/slow'] = slow
+    throttle.enable_cache()
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        bodies = list(pool.map(
+            lambda i: throttle.get(standin.url + '/slow',
+                                   params={'q': 'x'}).content, range(6)))
+    assert bodies == [b'shared'] * 6
+    assert standin.count('/slow') == 1
+
+
+def test_cache_evicts_least_recently_used(standin, throttle):
+    for name in ('a', 'b', 'c'):
+        standin.routes['/' + name] = lambda handler: (200, {}, b'x' * 100)
+    throttle.configure(cache_max_bytes=250)
+    throttle.enable_cache()
+    throttle.get(standin.url + '/a')
+    throttle.get(standin.url + '/b')
+    throttle.get(standin.url + '/a')
+    # Over 250 bytes: /b is the least recently used and is dropped
+    throttle.get(standin.url + '/c')
+    throttle.get(standin.url + '/a')
+    throttle.get(standin.url + '/b')
+    assert standin.count('/a') == 1
+    assert standin.count('/b') == 2
+    assert standin.count('/c') == 1
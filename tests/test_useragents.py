@@ -0,0 +1,66 @@
+import json
+import threading
+
+import pandas as pd
+
+import pyEDIutils.useragents as ua
+
+AGENTS = ['zbot/1.0', 'Mozilla/5.0 (compatible; Googlebot/2.1)',
+          'python-requests/2.31', 'Mozilla/5.0 (X11; Linux) Firefox/120',
+          None]
+
+
+def test_agent_table_codes_match_add_agent_class(tmp_path):
+    df = pd.DataFrame({'useragent': AGENTS * 3})
+    cache = str(tmp_path / 'ua.json')
+    out = ua.add_agent_class(df, cache_path=cache)
+    table = ua.agent_table(df.useragent, cache_path=cache)
+    codes = out.useragent.cat.codes
+    known = codes >= 0
+    joined = table.agent_category.to_numpy()[codes[known]]
+    assert list(joined) == list(out.agent_category[known])
+    assert table.loc[codes[1], 'useragent'] == AGENTS[1]
+    assert out.agent_category[1] == 'search_engine'
+    assert out.agent_category[4] == 'unknown'
+
+
+def test_memory_only_call_does_not_shadow_disk_cache(tmp_path):
+    cache = str(tmp_path / 'ua.json')
+    with open(cache, 'w') as f:
+        json.dump({'rules': ua.rules_key(), 'agents':
+                   {'custom-agent/1': 'monitor'}}, f)
+    ua.classify(['wget/1.2'], cache_path=None)
+    assert ua.classify(['custom-agent/1'], cache_path=cache) == ['monitor']
+    ua.classify(['curl/8'], cache_path=cache)
+    with open(cache) as f:
+        saved = json.load(f)['agents']
+    assert saved['custom-agent/1'] == 'monitor'
+    assert 'curl/8' in saved
+
+
+def test_concurrent_classify_and_save(tmp_path):
+    cache = str(tmp_path / 'ua.json')
+    errors = []
+    def work(n):
+        try:
+            ua.classify(['agent-{0}-{1}'.format(n, i) for i in range(300)],
+                        cache_path=cache)
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    with open(cache) as f:
+        assert len(json.load(f)['agents']) == 8 * 300
+
+
+def test_reference_managers_are_not_robots():
+    df = ua.add_agent_class(pd.DataFrame({'useragent': [
+        'Zotero/7.0.11', 'Mozilla/5.0 (X11) Zotero/6.0.30', '', None]}),
+        cache_path=None)
+    assert df.agent_category.tolist() == ['browser', 'browser', 'unknown',
+                                          'unknown']
+    assert df.is_robot.tolist() == [False, False, True, True]
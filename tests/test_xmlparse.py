@@ -0,0 +1,88 @@
+"""The *_to_df parsers give the same dataframes with either XML backend."""
+import os
+
+import pandas as pd
+import pytest
+
+import pyEDIutils.audit_rpts as aud
+import pyEDIutils.changes as changes
+import pyEDIutils.pasta_api_requests as rq
+import pyEDIutils.pkginfo as pkginfo
+import pyEDIutils.search as search
+import pyEDIutils.xmlparse as xp
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def load(name):
+    with open(os.path.join(DATA, name), 'rb') as f:
+        return(xp.fromstring(f.read()))
+
+
+def with_backend(backend, func):
+    saved = xp.get_backend()
+    try:
+        xp.set_backend(backend)
+    except ImportError:
+        pytest.skip('lxml is not installed')
+    try:
+        return(func())
+    finally:
+        xp.set_backend(saved)
+
+
+def parity(func):
+    """Run func under both backends and check the results are identical"""
+    results = [with_backend(b, func) for b in ('stdlib', 'lxml')]
+    pd.testing.assert_frame_equal(results[0], results[1])
+    return(results[0])
+
+
+def test_changes_parity():
+    df = parity(lambda: changes.changeroot_to_df(load('changes.xml')))
+    assert df.pkgid.tolist() == [210001001, 210001001, 210002002]
+    assert df.action.tolist() == ['createDataPackage', 'updateDataPackage',
+                                  'deleteDataPackage']
+
+
+def test_audit_parity():
+    df = parity(lambda: aud.auditroot_to_df(load('audit.xml')))
+    assert df.resource.tolist() == ['package', 'data']
+    assert df.non_robot_reads.tolist() == [12, 0]
+
+
+def test_auditreport_parity():
+    df = parity(lambda: aud.auditreport_to_df(load('auditreport.xml')))
+    assert df.useragent.tolist() == [
+        'Mozilla/5.0 (X11; Linux x86_64) & friends',
+        'python-requests/2.31.0 <bot>']
+    # Empty elements come through as missing with both backends
+    assert pd.isna(df.group[0]) and df.group[1] == 'authenticated'
+
+
+def test_search_parity():
+    fields = ['packageid', 'doi', 'title', 'pubdate', 'keyword', 'author']
+    df = parity(lambda: search.searchroot_to_df(load('search.xml'), fields))
+    assert pd.isna(df.doi[1])
+    assert df.title[0].endswith('São Nicolau plots')
+    assert df.authors.tolist() == ['Peters, Debra',
+                                   'Peters, Debra;Bestelmeyer, Brandon']
+
+
+def test_entity_table_parity(monkeypatch):
+    monkeypatch.setattr(rq, 'pkg_entity_names', lambda s, i, r:
+        pd.DataFrame({'entityid': ['3f2a'], 'entityname': ['Annual NPP']}))
+    monkeypatch.setattr(rq, 'pkg_entity_metadata', lambda s, i, r, e: e)
+    monkeypatch.setattr(rq, 'response_to_ET',
+                        lambda response: load('entity_metadata.xml'))
+    df = parity(lambda: pkginfo.entity_table('knb-lter-jrn', '210001001',
+                                             '2'))
+    assert df[['filename', 'entitytype', 'filetype']].values.tolist() == \
+        [['JRN_npp_annual.csv', 'dataTable', 'csv_D']]
+
+
+def test_lxml_parser_does_not_expand_entities():
+    doc = (b'<?xml version="1.0"?><!DOCTYPE r [<!ENTITY e "expanded">]>'
+           b'<r><userAgent>&e;</userAgent></r>')
+    root = with_backend('lxml', lambda: xp.fromstring(doc))
+    assert xp.extract(root, ['userAgent'])['userAgent'] != ['expanded']
@@ -0,0 +1,395 @@
+"""Retry, backoff, circuit breaking and adaptive concurrency for PASTA calls.
+
+Every request made by pyEDIutils goes through `get` (or `request`) in this
+module. Each host gets its own state: an AIMD concurrency limit that grows
+while responses are fast and healthy and is halved when the server throttles,
+a circuit breaker that stops sending requests to a host that keeps failing,
+and a shared "not before" time so a Retry-After header pauses every thread
+talking to that host, not just the one that received it.
+"""
+import requests
+from urllib.parse import urlparse
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from collections import OrderedDict
+import random
+import threading
+import time
+
+# Status codes and exceptions that are worth retrying
+RETRY_STATUS = (429, 500, 502, 503, 504)
+RETRY_EXCEPTIONS = (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError)
+
+# Tunable settings, shared by all hosts (see `configure`)
+settings = {
+    'max_retries': 5,       # retries after the first attempt
+    'backoff_base': 0.5,    # seconds, first backoff step
+    'backoff_max': 60.0,    # seconds, cap on any single wait
+    'timeout': (10, 120),   # (connect, read) seconds passed to requests
+    'min_concurrency': 1,
+    'max_concurrency': 16,
+    'start_concurrency': 4,
+    'target_latency': 2.0,  # seconds; slower responses stop the increase
+    'decrease_window': 2.0, # seconds; at most one halving per window
+    'breaker_threshold': 5, # consecutive failures that open the breaker
+    'breaker_cooldown': 30.0,  # seconds the breaker stays open
+    'breaker_max_wait': 60.0,  # seconds a caller waits on an open breaker
+    'cache_max_bytes': 256 * 1024 * 1024,  # bodies kept by the GET cache
+}
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised when a request is refused because the host's breaker is open."""
+
+
+class HostState(object):
+    """Concurrency limit, breaker and counters for a single host.
+
+    The concurrency limit follows additive-increase/multiplicative-decrease:
+    each healthy response adds 1/limit (about +1 per round of requests) and
+    a throttled or failed response halves it, at most once per
+    `decrease_window` so a burst of 429s counts as one signal. Throttling
+    (429, or 503 with Retry-After) only slows callers down. Other failures
+    (5xx, connection errors, timeouts) count toward the circuit breaker,
+    which opens after `breaker_threshold` consecutive failures. Callers wait
+    out the `breaker_cooldown` (up to `breaker_max_wait`), then a single
+    trial request goes through (half-open) before the breaker closes again.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.cond = threading.Condition()
+        self.limit = float(settings['start_concurrency'])
+        self.in_flight = 0
+        self.not_before = 0.0
+        self.breaker = 'closed'
+        self.opened_at = 0.0
+        self.consecutive_failures = 0
+        self.last_decrease = -float('inf')
+        self.counters = {'requests': 0, 'retries': 0, 'throttled': 0,
+                         'failures': 0, 'breaker_trips': 0,
+                         'latency_total': 0.0}
+
+    def acquire(self):
+        """Block until a concurrency slot is free and the host is callable.
+
+        Raises CircuitOpenError only if the breaker stays open for longer
+        than `breaker_max_wait` seconds.
+        """
+        deadline = time.monotonic() + settings['breaker_max_wait']
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                if self.breaker == 'open':
+                    reopen = self.opened_at + settings['breaker_cooldown']
+                    if now < reopen:
+                        if reopen > deadline:
+                            raise CircuitOpenError(
+                                'Circuit breaker open for {0}'.format(
+                                    self.host))
+                        self.cond.wait(reopen - now)
+                        continue
+                    self.breaker = 'half-open'
+                if self.breaker == 'half-open' and self.in_flight > 0:
+                    # Only one trial request while half-open
+                    self.cond.wait(0.5)
+                    continue
+                if now < self.not_before:
+                    self.cond.wait(self.not_before - now)
+                    continue
+                if self.in_flight < max(1, int(self.limit)):
+                    self.in_flight += 1
+                    self.counters['requests'] += 1
+                    return
+                self.cond.wait(1.0)
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self.last_decrease >= settings['decrease_window']:
+            self.limit = max(settings['min_concurrency'], self.limit / 2)
+            self.last_decrease = now
+
+    def release(self, outcome, latency):
+        """Return a slot and update the limit, breaker and counters.
+
+        outcome is 'ok', 'throttled', 'failed', or 'neutral' (a client-side
+        error that says nothing about the server's health).
+        """
+        with self.cond:
+            self.in_flight -= 1
+            self.counters['latency_total'] += latency
+            if outcome == 'throttled':
+                self.counters['throttled'] += 1
+                self._decrease()
+                if self.breaker == 'half-open':
+                    # The trial got an answer, so the host is up
+                    self.breaker = 'closed'
+            elif outcome == 'failed':
+                self.counters['failures'] += 1
+                self._decrease()
+                self.consecutive_failures += 1
+                if (self.breaker == 'half-open' or self.consecutive_failures
+                        >= settings['breaker_threshold']):
+                    if self.breaker != 'open':
+                        self.counters['breaker_trips'] += 1
+                    self.breaker = 'open'
+                    self.opened_at = time.monotonic()
+            elif outcome == 'ok':
+                self.consecutive_failures = 0
+                self.breaker = 'closed'
+                if latency <= settings['target_latency']:
+                    self.limit = min(settings['max_concurrency'],
+                                     self.limit + 1.0 / self.limit)
+            elif self.breaker == 'half-open':
+                # No verdict from the trial request; let another one through
+                self.breaker = 'open'
+                self.opened_at = (time.monotonic() -
+                                  settings['breaker_cooldown'])
+            self.cond.notify_all()
+
+    def delay_all(self, seconds):
+        """Make every thread wait at least `seconds` before the next call."""
+        with self.cond:
+            self.not_before = max(self.not_before,
+                                  time.monotonic() + seconds)
+
+    def snapshot(self):
+        with self.cond:
+            out = dict(self.counters)
+            n = out['requests']
+            out['mean_latency'] = out['latency_total'] / n if n else 0.0
+            out.update({'concurrency_limit': round(self.limit, 2),
+                        'in_flight': self.in_flight,
+                        'breaker': self.breaker})
+        return(out)
+
+
+_hosts = {}
+_hosts_lock = threading.Lock()
+_session = requests.Session()
+# Shared GET response cache (least recently used first), off unless
+# enable_cache() is called, and the requests currently being fetched for it
+_cache = None
+_cache_bytes = 0
+_inflight = {}
+_cache_lock = threading.Lock()
+
+
+def _host_state(url):
+    host = urlparse(url).netloc
+    with _hosts_lock:
+        if host not in _hosts:
+            _hosts[host] = HostState(host)
+        return(_hosts[host])
+
+
+def configure(**kwargs):
+    """Change retry/backoff/concurrency settings (see `settings` keys)"""
+    for k, v in kwargs.items():
+        if k not in settings:
+            raise KeyError('Unknown throttle setting: {0}'.format(k))
+        settings[k] = v
+
+
+def stats():
+    """Return current counters for each host as a dict of dicts
+
+    Counters are requests, retries, throttled, failures, breaker_trips,
+    latency_total and mean_latency, plus the current concurrency_limit,
+    in_flight count and breaker state.
+    """
+    with _hosts_lock:
+        states = list(_hosts.values())
+    return({s.host: s.snapshot() for s in states})
+
+
+def reset():
+    """Forget all per-host state and counters"""
+    with _hosts_lock:
+        _hosts.clear()
+
+
+def enable_cache():
+    """Cache successful GET responses in memory, keyed by full request URL
+
+    Only unauthenticated, non-streamed requests made with the shared session
+    are cached. Identical requests made while one is in flight wait for it
+    instead of going to the server too. The least recently used responses
+    are evicted once the cached bodies exceed settings['cache_max_bytes'].
+    Used by `jobs` so that steps sharing a run do not repeat identical PASTA
+    requests.
+    """
+    global _cache, _cache_bytes
+    with _cache_lock:
+        if _cache is None:
+            _cache = OrderedDict()
+            _cache_bytes = 0
+
+
+def cache_enabled():
+    """True if the response cache is on (see `enable_cache`)"""
+    return(_cache is not None)
+
+
+def disable_cache():
+    """Turn off and empty the response cache"""
+    global _cache, _cache_bytes
+    with _cache_lock:
+        _cache = None
+        _cache_bytes = 0
+
+
+def _cache_key(method, url, session, kwargs):
+    if (_cache is None or method != 'GET' or session is not None or
+            kwargs.get('stream') or kwargs.get('auth') is not None):
+        return(None)
+    prepared = requests.Request(method, url, params=kwargs.get('params'),
+                                headers=kwargs.get('headers')).prepare()
+    return((prepared.url, tuple(sorted(prepared.headers.items()))))
+
+
+def _cache_store(key, response):
+    # Called with _cache_lock held
+    global _cache_bytes
+    size = len(response.content)
+    if _cache is None or size > settings['cache_max_bytes']:
+        return
+    if key in _cache:
+        _cache_bytes -= len(_cache.pop(key).content)
+    _cache[key] = response
+    _cache_bytes += size
+    while _cache_bytes > settings['cache_max_bytes']:
+        _, old = _cache.popitem(last=False)
+        _cache_bytes -= len(old.content)
+
+
+def retry_after_seconds(response):
+    """Parse a Retry-After header (seconds or HTTP-date) into seconds"""
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return(None)
+    try:
+        return(max(0.0, float(value)))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return(None)
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return(max(0.0, (when - datetime.now(timezone.utc)).total_seconds()))
+
+
+def _outcome(response):
+    """Classify a response as 'ok', 'throttled' or 'failed'"""
+    status = response.status_code
+    if status == 429 or (status == 503 and 'Retry-After' in response.headers):
+        return('throttled')
+    if status >= 500:
+        return('failed')
+    return('ok')
+
+
+def backoff_seconds(attempt):
+    """Full-jitter exponential backoff for a (0-based) retry attempt"""
+    cap = min(settings['backoff_max'],
+              settings['backoff_base'] * (2 ** attempt))
+    return(random.uniform(0, cap))
+
+
+def request(method, url, session=None, **kwargs):
+    """Make an HTTP request with retries, backoff and per-host throttling
+
+    Retries connection errors, timeouts and 429/5xx responses with
+    jittered exponential backoff, honoring Retry-After when the server sends
+    one. Returns the final `requests.Response`, which may still carry an
+    error status once retries are exhausted; callers that need a body should
+    check it (see `pasta_api_requests.response_to_ET`).
+
+    Parameters
+    ----------
+    method : str
+        HTTP method ('GET', 'HEAD', ...)
+    url : str
+        Request URL
+    session : requests.Session, optional
+        Session to send the request with, by default a shared module session
+    **kwargs
+        Passed on to `requests.Session.request`
+    """
+    key = _cache_key(method, url, session, kwargs)
+    if key is None:
+        return(_send(method, url, session, kwargs))
+    while True:
+        with _cache_lock:
+            if _cache is not None and key in _cache:
+                _cache.move_to_end(key)
+                return(_cache[key])
+            pending = _inflight.get(key)
+            if pending is None:
+                pending = _inflight[key] = threading.Event()
+                break
+        # Same request already in flight; use its response once it is
+        # cached, or make the request here if it was not cacheable
+        pending.wait()
+    try:
+        response = _send(method, url, session, kwargs)
+        if response.status_code == 200:
+            with _cache_lock:
+                _cache_store(key, response)
+    finally:
+        with _cache_lock:
+            del _inflight[key]
+        pending.set()
+    return(response)
+
+
+def _send(method, url, session, kwargs):
+    if session is None:
+        session = _session
+    kwargs.setdefault('timeout', settings['timeout'])
+    state = _host_state(url)
+    attempt = 0
+    while True:
+        state.acquire()
+        start = time.monotonic()
+        # Every acquired slot is released, whatever the request raises
+        outcome = 'neutral'
+        error = None
+        try:
+            response = session.request(method, url, **kwargs)
+            outcome = _outcome(response)
+        except RETRY_EXCEPTIONS as e:
+            outcome = 'failed'
+            error = e
+        finally:
+            state.release(outcome, time.monotonic() - start)
+        if error is not None:
+            if attempt >= settings['max_retries']:
+                raise error
+            wait = backoff_seconds(attempt)
+        else:
+            status = response.status_code
+            if status not in RETRY_STATUS or attempt >= settings['max_retries']:
+                return(response)
+            wait = retry_after_seconds(response)
+            if wait is None:
+                wait = backoff_seconds(attempt)
+            else:
+                wait = min(wait, settings['backoff_max'])
+                state.delay_all(wait)
+            response.close()
+        attempt += 1
+        with state.cond:
+            state.counters['retries'] += 1
+        print('Retrying {0} in {1:.1f}s (attempt {2})'.format(
+            url, wait, attempt))
+        time.sleep(wait)
+
+
+def get(url, session=None, **kwargs):
+    """GET `url` through `request` (see there for details)"""
+    return(request('GET', url, session=session, **kwargs))
@@ -0,0 +1,212 @@
+"""Classify audit report user agents as robots or humans.
+
+Classification is done on the unique user-agent strings only, with a single
+compiled regular expression built from RULES, and results are memoized in
+memory and in a JSON cache file so later runs only classify agents they
+have not seen. Adding the result to an audit report is then a lookup by
+categorical code rather than a regex over every row.
+
+Reads with a missing or empty user agent are classed 'unknown' and counted
+as robots (ROBOT_CATEGORIES): browsers always send one, so an empty agent
+almost always means a script. Reference managers such as Zotero fetch a
+page because a person asked for it, so they are left as 'browser'.
+"""
+import pandas as pd
+import numpy as np
+import hashlib
+import json
+import os
+import re
+import threading
+
+# (category, pattern) rules, checked in order; the first rule whose pattern
+# occurs anywhere in the user agent (case-insensitive) wins. Agents that
+# match no rule are 'browser', empty or missing agents are 'unknown'.
+RULES = [
+    ('search_engine', r'googlebot|bingbot|slurp|duckduckbot|baiduspider|'
+                      r'yandex|sogou|exabot|seznambot|applebot|petalbot'),
+    ('crawler', r'bot\b|bot/|crawl|spider|scrap|archiver|ia_archiver|'
+                r'semrush|ahrefs|mj12|dotbot|facebookexternalhit|'
+                r'headless|phantomjs|scholar|citeseer'),
+    ('monitor', r'uptime|pingdom|monitor|nagios|check_http|statuscake|'
+                r'site24x7|newrelic'),
+    ('script', r'python|requests|urllib|aiohttp|httpx|curl|wget|'
+               r'libwww|lwp::|java/|okhttp|go-http-client|axios|node-fetch|'
+               r'^r \(|\br/|rcurl|httr|pasta|edi-|ecocomdp'),
+]
+# Categories counted as robots
+ROBOT_CATEGORIES = ('search_engine', 'crawler', 'monitor', 'script',
+                    'unknown')
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser('~'), '.cache',
+                             'pyEDIutils', 'useragents.json')
+
+_memo = {}
+_memo_lock = threading.Lock()
+_save_lock = threading.Lock()
+_compiled = {}
+
+
+def rules_key(rules=RULES):
+    """Short hash of a rule list, used to invalidate cached results"""
+    return(hashlib.sha1(json.dumps(rules).encode()).hexdigest()[:12])
+
+
+def compile_rules(rules=RULES):
+    """Compile a rule list into one regex
+
+    Each rule becomes a lookahead followed by an empty named group, all
+    anchored at the start of the string, so alternatives are tried in rule
+    order and `match.lastgroup` names the first rule that matches.
+    """
+    key = rules_key(rules)
+    if key not in _compiled:
+        alts = ['(?=.*?(?:{0}))(?P<r{1}>)'.format(pat, i)
+                for i, (cat, pat) in enumerate(rules)]
+        _compiled[key] = re.compile('^(?:' + '|'.join(alts) + ')',
+                                    re.IGNORECASE | re.DOTALL)
+    return(_compiled[key])
+
+
+def _load_cache(cache_path, key):
+    if cache_path is None or not os.path.exists(cache_path):
+        return({})
+    with open(cache_path, 'r') as f:
+        saved = json.load(f)
+    if saved.get('rules') != key:
+        return({})
+    return(saved.get('agents', {}))
+
+
+def _save_cache(cache_path, key, agents):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    # Per-process temporary name so concurrent runs do not collide
+    tmp_path = '{0}.{1}.part'.format(cache_path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump({'rules': key, 'agents': agents}, f)
+    os.replace(tmp_path, cache_path)
+
+
+def classify(agents, rules=RULES, cache_path=DEFAULT_CACHE):
+    """Classify unique user-agent strings
+
+    Parameters
+    ----------
+    agents : iterable of str
+        user-agent strings, ideally already unique
+    rules : list of (category, pattern), optional
+        classification rules, by default RULES
+    cache_path : str or None, optional
+        JSON file to memoize results across runs, by default
+        '~/.cache/pyEDIutils/useragents.json'; None keeps results in
+        memory only
+
+    Returns
+    -------
+    list of str
+        category for each agent
+    """
+    key = rules_key(rules)
+    # One memo per rule set and cache file, so an in-memory-only call never
+    # shadows (or later overwrites) a larger cache on disk
+    with _memo_lock:
+        if (key, cache_path) not in _memo:
+            _memo[(key, cache_path)] = _load_cache(cache_path, key)
+        memo = _memo[(key, cache_path)]
+    regex = compile_rules(rules)
+    out = []
+    new = False
+    for ua in agents:
+        if ua is None or (isinstance(ua, float) and np.isnan(ua)) or \
+                not str(ua).strip():
+            out.append('unknown')
+            continue
+        cat = memo.get(ua)
+        if cat is None:
+            m = regex.match(ua)
+            cat = rules[int(m.lastgroup[1:])][0] if m else 'browser'
+            with _memo_lock:
+                memo[ua] = cat
+            new = True
+        out.append(cat)
+    if new and cache_path is not None:
+        # Saves are serialized and each copies the memo when its turn
+        # comes, so an older snapshot never replaces a newer one
+        with _save_lock:
+            with _memo_lock:
+                agents_copy = dict(memo)
+            _save_cache(cache_path, key, agents_copy)
+    return(out)
+
+
+def agent_table(useragents, **kwargs):
+    """Lookup table of the unique user agents in a column
+
+    Parameters
+    ----------
+    useragents : pandas Series
+        user-agent column of an audit report (see auditreport_to_df)
+    **kwargs
+        passed on to classify
+
+    Returns
+    -------
+    dataframe
+        one row per unique agent, indexed by the agent's code in
+        `useragents.astype('category')` (the codes add_agent_class uses),
+        with useragent, agent_category and is_robot columns
+    """
+    uniques = useragents.astype('category').cat.categories
+    cats = classify(uniques, **kwargs)
+    df = pd.DataFrame({'useragent': uniques, 'agent_category': cats})
+    df['is_robot'] = df.agent_category.isin(ROBOT_CATEGORIES)
+    df.index.name = 'agent_code'
+    return(df)
+
+
+def add_agent_class(df, col='useragent', **kwargs):
+    """Add agent_category and is_robot columns to an audit report
+
+    The user-agent column is converted to a categorical, only its categories
+    are classified, and the results are mapped back to rows by code.
+
+    Parameters
+    ----------
+    df : dataframe
+        audit report dataframe (see auditreport_to_df)
+    col : str, optional
+        name of the user-agent column, by default 'useragent'
+    **kwargs
+        passed on to classify
+
+    Returns
+    -------
+    dataframe
+        copy of df with a categorical user-agent column and added
+        agent_category and is_robot columns
+    """
+    df = df.copy()
+    agents = df[col].astype('category')
+    df[col] = agents
+    cats = np.array(classify(agents.cat.categories, **kwargs) + ['unknown'],
+                    dtype=object)
+    # Missing agents have code -1, which picks the trailing 'unknown'
+    df['agent_category'] = pd.Categorical(cats[agents.cat.codes.to_numpy()])
+    df['is_robot'] = df['agent_category'].isin(ROBOT_CATEGORIES)
+    return(df)
+
+
+def robot_breakdown(df, by=None):
+    """Count audit records by agent category (and optional other columns)
+
+    Parameters
+    ----------
+    df : dataframe
+        audit report with agent_category and is_robot columns (see
+        add_agent_class)
+    by : str or list, optional
+        additional columns to group by, e.g. 'method', by default None
+    """
+    keys = ([] if by is None else ([by] if isinstance(by, str) else list(by)))
+    return(df.groupby(keys + ['is_robot', 'agent_category'], observed=True)
+           .size().rename('n').reset_index())
@@ -0,0 +1,105 @@
+"""XML parser backends for PASTA responses.
+
+lxml is used when it is installed and the standard library ElementTree
+otherwise; `set_backend` switches between them. Both backends produce
+element trees with the same `iter`/`find`/`text` interface, and `extract`
+pulls the text of several tags out of a tree in a single pass (lxml's
+C-level multi-tag `iter()`, or one filtered `iter()` walk under the
+stdlib), so the `*_to_df` functions give identical dataframes with either
+backend.
+"""
+import xml.etree.ElementTree as ET
+try:
+    from lxml import etree as _lxml
+except ImportError:
+    _lxml = None
+
+# Tags extracted by the *_to_df functions, by response schema
+SCHEMAS = {
+    'changes': ('date', 'identifier', 'serviceMethod'),
+    'audit': ('scope', 'identifier', 'revision', 'resourceType',
+              'totalReads', 'nonRobotReads'),
+    'auditreport': ('entryTime', 'serviceMethod', 'resourceId', 'user',
+                    'groups', 'userAgent'),
+    'entity_metadata': ('fileName', 'dataFormat'),
+    # Default single-valued fields of a package search (search_pasta);
+    # searchroot_to_df extracts whichever fields were requested
+    'search': ('packageid', 'doi', 'title', 'pubdate'),
+}
+
+_backend = 'lxml' if _lxml is not None else 'stdlib'
+
+
+def get_backend():
+    """Name of the parser backend in use ('lxml' or 'stdlib')"""
+    return(_backend)
+
+
+def set_backend(name):
+    """Select the parser backend
+
+    Parameters
+    ----------
+    name : str
+        'lxml' or 'stdlib'
+    """
+    global _backend
+    if name not in ('lxml', 'stdlib'):
+        raise ValueError('Unknown XML backend: {0}'.format(name))
+    if name == 'lxml' and _lxml is None:
+        raise ImportError('lxml is not installed')
+    _backend = name
+
+
+def _lxml_parser():
+    # libxml2's default size and depth limits stay on, and entities are not
+    # expanded, since the input comes from the network
+    return(_lxml.XMLParser(resolve_entities=False, no_network=True))
+
+
+def fromstring(data):
+    """Parse XML bytes (or str) into a root element"""
+    if _backend == 'lxml':
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        return(_lxml.fromstring(data, _lxml_parser()))
+    return(ET.fromstring(data))
+
+
+def parse(source):
+    """Parse an XML file (path or binary file object) into a root element"""
+    if _backend == 'lxml':
+        return(_lxml.parse(source, _lxml_parser()).getroot())
+    return(ET.parse(source).getroot())
+
+
+def extract(root, tags):
+    """Collect the text of every element with one of `tags`, in one pass
+
+    Parameters
+    ----------
+    root : element
+        root element from either backend
+    tags : sequence of str
+        tag names to collect (see SCHEMAS for the ones used here)
+
+    Returns
+    -------
+    dict
+        tag -> list of element text (None for empty elements), in document
+        order
+    """
+    tags = tuple(tags)
+    out = {t: [] for t in tags}
+    if not tags:
+        return(out)
+    if _lxml is not None and isinstance(root, _lxml._Element):
+        # Tag matching happens in C; an XPath union ('//a | //b') is much
+        # slower on large trees because of its document-order merge
+        for el in root.iter(*tags):
+            out[el.tag].append(el.text)
+    else:
+        for el in root.iter():
+            if el.tag in out:
+                out[el.tag].append(el.text)
+    return(out)